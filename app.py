@@ -1,19 +1,67 @@
 import json
 import logging
+import os
 import time
 import uuid
-from typing import List
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 import boto3
 import jwt
 import pymongo
-from fastapi import FastAPI, File, HTTPException, Request, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import Response
 from odmantic import AIOEngine, ObjectId
 from pydantic import UUID4, BaseModel, ByteSize
 from starlette.types import Message
 from server.config import BaseConfig, Env
-from server.database import client
+from faire.server.database import client, close_pool, warm_pool
+from faire.server.auth import (
+    authenticate_request,
+    brand_scope,
+    require_admin,
+    synced_brand_scope,
+)
 from faire.server.faire_API import run_orders
+from faire.server.faire_client import FaireClient
+from faire.server.models.enums import OrderState
+from faire.server.notifications import order_notifier
+from faire.server.order_reads import (
+    find_order,
+    find_orders,
+    order_filter,
+    ensure_read_indexes,
+    order_page_version,
+    order_version,
+)
+from faire.server.order_import import (
+    MAX_RUNNING_IMPORTS,
+    ImportJob,
+    import_jobs,
+    spool_upload,
+    start_import,
+    stop_imports,
+)
+from faire.server.order_store import ensure_order_indexes
+from faire.server.product_sales import (
+    ensure_sales_indexes,
+    product_timeseries,
+    top_products,
+)
+from faire.server.profiling import profiler, timings
+from faire.server.response_cache import conditional_response
+from faire.server.serialization import dumps, order_serializer
+from faire.server.shipments import ShipmentRefresher, ensure_shipment_indexes
+from faire.server.search import ensure_search_indexes, search_orders
+from faire.server.webhooks import (
+    SIGNATURE_HEADER,
+    ConsistencyPoller,
+    InvalidWebhook,
+    OrderFetchQueue,
+    event_order_id,
+    seen_events,
+    verify_signature,
+)
+from faire.server.worker_lock import acquire_worker_lock
 
 
 # get root logger
@@ -29,6 +77,93 @@ app = FastAPI()
 if not config.mongo_details:
     raise Exception("Environment variables not set.")
 engine = AIOEngine(client=client, database=config.database)
+faire_client = FaireClient("yate")
+order_fetch_queue = OrderFetchQueue(
+    faire_client,
+    coalesce_seconds=config.webhook_coalesce_seconds,
+    max_concurrency=config.webhook_fetch_concurrency,
+)
+consistency_poller = ConsistencyPoller(
+    faire_client, interval_seconds=config.consistency_poll_seconds
+)
+shipment_refresher = ShipmentRefresher(
+    faire_client,
+    interval_seconds=config.shipment_refresh_seconds,
+    batch_size=config.shipment_refresh_batch_size,
+    max_orders=config.shipment_refresh_max_orders,
+    max_concurrency=config.shipment_refresh_concurrency,
+)
+# Imports and the sales rollup are not keyed by brand, they belong to the synced brand
+synced_brand = synced_brand_scope(faire_client.brand)
+
+
+@app.on_event("startup")
+async def warm_connection_pools():
+    await warm_pool()
+
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_order_indexes()
+    await ensure_read_indexes()
+    await ensure_search_indexes()
+    await ensure_sales_indexes()
+    await ensure_shipment_indexes()
+    await seen_events.ensure_indexes()
+    await import_jobs.ensure_indexes()
+
+
+@app.on_event("startup")
+async def start_order_sync():
+    order_notifier.start()
+    order_fetch_queue.start()
+    if acquire_worker_lock(config.scheduler_lock_path):
+        consistency_poller.start()
+        shipment_refresher.start()
+
+
+@app.on_event("shutdown")
+async def stop_order_sync():
+    # Imports can run for minutes, they are cancelled rather than waited for
+    await stop_imports()
+    await shipment_refresher.stop()
+    await consistency_poller.stop()
+    await order_fetch_queue.stop()
+    # Last, so digests include the orders fetched while draining
+    await order_notifier.stop()
+
+
+@app.on_event("shutdown")
+async def close_connection_pools():
+    # Runs after uvicorn has drained in-flight requests and the sync tasks have stopped
+    await faire_client.aclose()
+    close_pool()
+
+
+@app.on_event("startup")
+async def start_startup_profile():
+    if config.profile_seconds:
+        path = profiler.start(config.profile_seconds)
+        logger.info(f"profiling for {config.profile_seconds}s to {path}")
+
+
+# Reachable without a bearer token; the webhook carries its own signature
+PUBLIC_PATHS = {"/", "/docs", "/redoc", "/openapi.json", "/webhooks/faire"}
+
+
+@app.middleware("http")
+async def authenticate(request: Request, call_next):
+    """verifies the bearer token and attaches the caller's brand scope to the request"""
+    if (
+        not config.auth_enabled
+        or request.method == "OPTIONS"
+        or request.url.path in PUBLIC_PATHS
+    ):
+        return await call_next(request)
+    error = await authenticate_request(request)
+    if error is not None:
+        return error
+    return await call_next(request)
 
 
 @app.middleware("http")
@@ -41,6 +176,11 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
 
     process_time = (time.time() - start_time) * 1000
+    if timings.enabled:
+        # Group by route template so per-order paths share one span
+        route = request.scope.get("route")
+        path = route.path if route else request.url.path
+        timings.record(f"api {request.method} {path}", process_time / 1000)
     formatted_process_time = "{0:.2f}".format(process_time)
     logger.info(
         f"rid={idem} completed_in={formatted_process_time}ms status_code={response.status_code}"
@@ -100,7 +240,212 @@ async def read_root():
     return {"message": "Welcome to this fantastic app!"}
 
 
+@app.post("/webhooks/faire", status_code=202, tags=["Webhooks"])
+async def faire_webhook(request: Request):
+    """
+    Receive a Faire order event. The order is fetched asynchronously; repeated events for
+    the same order are coalesced and redelivered event ids are ignored.
+    """
+    body = await request.body()
+    signature = request.headers.get(SIGNATURE_HEADER)
+    if not verify_signature(body, signature, config.faire_webhook_secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        event = json.loads(body)
+        order_id = event_order_id(event)
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid webhook payload: {e}")
+
+    event_id = str(event["id"]) if event.get("id") else None
+    if event_id and await seen_events.seen(event_id):
+        return {"status": "duplicate"}
+    order_fetch_queue.enqueue(order_id, event_id)
+    return {"status": "accepted"}
+
+
+@app.get("/admin/webhooks", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def get_webhook_stats():
+    return order_fetch_queue.dict()
+
+
+@app.get(
+    "/admin/notifications", tags=["Admin"], dependencies=[Depends(require_admin)]
+)
+async def get_notification_stats():
+    return order_notifier.dict()
+
+
+@app.get("/admin/shipments", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def get_shipment_refresh_stats():
+    return shipment_refresher.dict()
+
+
+@app.post(
+    "/admin/shipments/refresh", tags=["Admin"], dependencies=[Depends(require_admin)]
+)
+async def refresh_shipments():
+    """Re-fetch in transit orders now instead of waiting for the next scheduled run"""
+    refreshed = await shipment_refresher.refresh()
+    return {"refreshed": refreshed, **shipment_refresher.dict()}
+
+
+@app.post("/admin/profile", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def start_profile(seconds: int = Query(10, ge=1, le=600)):
+    """
+    Sample the running process for N seconds and write folded flamegraph stacks.
+    With several workers only the worker that answers (pid) is profiled.
+    """
+    path = profiler.start(seconds)
+    if not path:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return {"seconds": seconds, "output": path, "pid": os.getpid()}
+
+
+@app.get("/admin/timings", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def get_timings():
+    """Span timings of the worker that answers (pid), each worker keeps its own"""
+    return {"enabled": timings.enabled, "spans": timings.dict(), "pid": os.getpid()}
+
+
+@app.post("/admin/timings", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def set_timings(enabled: bool = True, reset: bool = False):
+    timings.enabled = enabled
+    if reset:
+        timings.reset()
+    return {"enabled": timings.enabled, "spans": timings.dict(), "pid": os.getpid()}
+
+
 @app.get("/orders")
-async def get_orders():
-    orders = run_orders()
-    return orders
\ No newline at end of file
+async def get_orders(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    page: int = Query(1, ge=1),
+    state: Optional[OrderState] = None,
+    brand: Optional[str] = Depends(brand_scope),
+):
+    """
+    Page through stored orders, newest first.
+    Supports If-None-Match: unchanged pages are answered with 304 Not Modified.
+    """
+    query = order_filter(state=state, brand=brand)
+    skip = (page - 1) * limit
+
+    async def body() -> bytes:
+        return order_serializer.dumps_many(await find_orders(query, skip, limit))
+
+    return await conditional_response(
+        request,
+        "orders",
+        {"limit": limit, "page": page, "state": state, "brand": brand},
+        lambda: order_page_version(query, skip, limit),
+        body,
+    )
+
+
+@app.post(
+    "/orders/import",
+    status_code=202,
+    dependencies=[Depends(require_admin), Depends(synced_brand)],
+)
+async def import_orders(file: UploadFile = File(...)):
+    """
+    Bulk import an order dump in Faire's /orders JSON format.
+    Responds with the job as soon as the upload is received; the dump is then parsed
+    incrementally and upserted in batches, and progress can be polled from
+    GET /orders/import/{job_id}.
+    """
+    if import_jobs.running() >= MAX_RUNNING_IMPORTS:
+        raise HTTPException(status_code=429, detail="Too many imports running")
+    job = ImportJob(filename=file.filename)
+    path = await spool_upload(file)
+    start_import(path, faire_client, job)
+    return job.dict()
+
+
+@app.get("/orders/import/{job_id}", dependencies=[Depends(require_admin)])
+async def get_import_job(job_id: str):
+    job = await import_jobs.find(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    return job
+
+
+@app.get("/orders/search")
+async def search(
+    q: str = Query(..., min_length=2, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    brand: Optional[str] = Depends(brand_scope),
+):
+    """
+    Prefix search orders by customer name, retailer company, city, phone or product name.
+    Results are ranked by exact term matches then recency; pass next_cursor to page.
+    """
+    try:
+        results = await search_orders(q, limit=limit, cursor=cursor, brand=brand)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=dumps(results), media_type="application/json")
+
+
+@app.get("/orders/{order_id}")
+async def get_order(
+    request: Request, order_id: str, brand: Optional[str] = Depends(brand_scope)
+):
+    async def body() -> bytes:
+        order = await find_order(order_id, brand=brand)
+        if not order:
+            raise HTTPException(status_code=404, detail=f"Order {order_id} not found")
+        return order_serializer.dumps(order)
+
+    return await conditional_response(
+        request,
+        "order",
+        {"order_id": order_id, "brand": brand},
+        lambda: order_version(order_id, brand=brand),
+        body,
+    )
+
+
+def _date_range(start: Optional[date], end: Optional[date]):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=30)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return datetime.combine(start, datetime.min.time()), datetime.combine(
+        end, datetime.min.time()
+    )
+
+
+@app.get(
+    "/analytics/products/top", tags=["Analytics"], dependencies=[Depends(synced_brand)]
+)
+async def get_top_products(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    metric: str = Query("units", regex="^(units|gross_minor|tester_count|item_count)$"),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Best selling products between start and end (default: the last 30 days)"""
+    start_day, end_day = _date_range(start, end)
+    results = await top_products(start_day, end_day, metric=metric, limit=limit)
+    return Response(content=dumps(results), media_type="application/json")
+
+
+@app.get(
+    "/analytics/products/{product_id}",
+    tags=["Analytics"],
+    dependencies=[Depends(synced_brand)],
+)
+async def get_product_timeseries(
+    product_id: str,
+    variant_id: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+):
+    """Daily units, gross and testers for a product or one of its variants"""
+    start_day, end_day = _date_range(start, end)
+    results = await product_timeseries(
+        product_id, start_day, end_day, variant_id=variant_id
+    )
+    return Response(content=dumps(results), media_type="application/json")
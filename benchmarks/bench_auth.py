@@ -0,0 +1,55 @@
+"""
+Per-request cost of bearer token verification with and without the verified token cache.
+
+usage: python -m faire.benchmarks.bench_auth [--requests 50000] [--tokens 100]
+"""
+import argparse
+import asyncio
+import time
+
+import jwt
+
+from faire.server import auth
+from faire.server.auth import Authenticator, SigningKeyCache, TokenCache
+
+SECRET = "benchmark-secret"
+
+
+def make_tokens(count: int) -> list:
+    expires = int(time.time()) + 3600
+    return [
+        jwt.encode({"sub": f"user-{index}", "brand": "yate", "exp": expires}, SECRET)
+        for index in range(count)
+    ]
+
+
+async def run(authenticator: Authenticator, tokens: list, requests: int) -> float:
+    start = time.perf_counter()
+    for index in range(requests):
+        await authenticator.verify(tokens[index % len(tokens)])
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--requests", type=int, default=50000)
+    arg_parser.add_argument("--tokens", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    auth.config.jwt_secret = SECRET
+    auth.config.jwt_algorithms = "HS256"
+    tokens = make_tokens(args.tokens)
+    signing_keys = SigningKeyCache(None, 0)
+
+    uncached = Authenticator(token_cache=None, signing_keys=signing_keys)
+    cached = Authenticator(
+        token_cache=TokenCache(max_size=10000, max_ttl_seconds=300),
+        signing_keys=signing_keys,
+    )
+    for name, authenticator in (("uncached", uncached), ("cached", cached)):
+        elapsed = asyncio.run(run(authenticator, tokens, args.requests))
+        print(f"{name:<9} {elapsed * 1e6 / args.requests:>8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
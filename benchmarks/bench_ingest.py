@@ -0,0 +1,76 @@
+"""
+Compare the Order model parse path against the fast ingest mappers.
+
+Reports orders/sec and allocated memory blocks per order (tracemalloc, documents kept
+alive) for FaireClient.parse_order(...).doc() and ingest.ingest_order(...).
+
+usage: python -m faire.benchmarks.bench_ingest [--orders 20000]
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+from faire.server.faire_client import FaireClient
+from faire.server.ingest import ingest_order
+
+ORDERS_JSON = os.path.join(os.path.dirname(__file__), "..", "server", "orders.json")
+
+
+def load_orders(count: int) -> list:
+    with open(ORDERS_JSON) as f:
+        sample = json.load(f)["orders"]
+    orders = []
+    for index in range(count):
+        order = copy.deepcopy(sample[index % len(sample)])
+        order["id"] = f"{order['id']}_{index}"
+        orders.append(order)
+    return orders
+
+
+def model_path(faire_client: FaireClient, orders: list) -> list:
+    return [faire_client.parse_order(order, 0).doc() for order in orders]
+
+
+def fast_path(orders: list) -> list:
+    return [ingest_order(order, 0, sample_rate=0) for order in orders]
+
+
+def measure(name: str, run, orders: list):
+    gc.collect()
+    start = time.perf_counter()
+    run(orders)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    documents = run(orders)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del documents
+
+    print(
+        f"{name:<8} {len(orders) / elapsed:>10.0f} orders/sec "
+        f"{blocks / len(orders):>8.1f} blocks/order {size / len(orders):>9.0f} bytes/order"
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--orders", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    orders = load_orders(args.orders)
+    faire_client = FaireClient("yate")
+    measure("model", lambda o: model_path(faire_client, o), orders)
+    measure("fast", fast_path, orders)
+
+
+if __name__ == "__main__":
+    main()
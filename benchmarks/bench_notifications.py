@@ -0,0 +1,81 @@
+"""
+Cost of order notifications on the sync path, and Slack calls made for a large sync.
+
+Slack is replaced by an in-process httpx.MockTransport stand-in that rate limits every
+--rate-limit-every request, so retries are exercised without network access.
+
+usage: python -m faire.benchmarks.bench_notifications [--orders 10000] [--pages 200]
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from faire.server.notifications import (
+    BACKORDERED,
+    CANCELED,
+    NEW_ORDER,
+    OrderEvent,
+    SlackNotifier,
+)
+
+KINDS = (NEW_ORDER, NEW_ORDER, NEW_ORDER, BACKORDERED, CANCELED)
+
+
+def slack_stand_in(rate_limit_every: int):
+    calls = {"requests": 0, "rate_limited": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls["requests"] += 1
+        if rate_limit_every and calls["requests"] % rate_limit_every == 0:
+            calls["rate_limited"] += 1
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"ok": True})
+
+    return httpx.MockTransport(handler), calls
+
+
+async def run(orders: int, pages: int, rate_limit_every: int):
+    transport, calls = slack_stand_in(rate_limit_every)
+    notifier = SlackNotifier(
+        api_key="benchmark",
+        api_url="http://slack.test/api",
+        channels={NEW_ORDER: "#orders", BACKORDERED: "#ops", CANCELED: "#ops"},
+        digest_seconds=0.05,
+        buffer_size=1000,
+        max_lines=20,
+        max_retries=3,
+        transport=transport,
+    )
+    notifier.start()
+    per_page = max(orders // pages, 1)
+    notify_seconds = 0.0
+    for page in range(pages):
+        events = [
+            OrderEvent(KINDS[index % len(KINDS)], f"order-{index}", f"D{index}", None)
+            for index in range(page * per_page, (page + 1) * per_page)
+        ]
+        start = time.perf_counter()
+        notifier.notify(events)
+        notify_seconds += time.perf_counter() - start
+        # Stand in for the fetch and persist work of a page
+        await asyncio.sleep(0.001)
+    await notifier.stop()
+    print(f"orders notified    {pages * per_page}")
+    print(f"notify cost        {notify_seconds * 1e6 / (pages * per_page):.2f} us/order")
+    print(f"slack requests     {calls['requests']} ({calls['rate_limited']} rate limited)")
+    print(f"notifier stats     {notifier.dict()}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--orders", type=int, default=10000)
+    arg_parser.add_argument("--pages", type=int, default=200)
+    arg_parser.add_argument("--rate-limit-every", type=int, default=5)
+    args = arg_parser.parse_args()
+    asyncio.run(run(args.orders, args.pages, args.rate_limit_every))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare the default response path (Order models through jsonable_encoder) against the
+orjson DocumentSerializer path for pages of 50, 500 and 5000 orders.
+
+usage: python -m faire.benchmarks.bench_serialize [--repeat 20]
+"""
+import argparse
+import json
+import time
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from faire.benchmarks.bench_ingest import load_orders
+from faire.server.ingest import ingest_order
+from faire.server.models.order import Order
+from faire.server.serialization import order_serializer
+
+PAGE_SIZES = (50, 500, 5000)
+
+
+def documents(count: int) -> list:
+    docs = []
+    for raw_order in load_orders(count):
+        document = ingest_order(raw_order, 0, sample_rate=0)
+        document["_id"] = ObjectId()
+        docs.append(document)
+    return docs
+
+
+def model_path(docs: list) -> bytes:
+    orders = [Order.parse_doc(document) for document in docs]
+    return json.dumps(jsonable_encoder(orders)).encode("utf-8")
+
+
+def fast_path(docs: list) -> bytes:
+    return order_serializer.dumps_many(docs)
+
+
+def best_of(run, docs: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(docs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    print(f"{'orders':>6} {'model ms':>10} {'orjson ms':>10} {'speedup':>8}")
+    for page_size in PAGE_SIZES:
+        docs = documents(page_size)
+        model = best_of(model_path, docs, args.repeat)
+        fast = best_of(fast_path, docs, args.repeat)
+        print(f"{page_size:>6} {model * 1000:>10.2f} {fast * 1000:>10.2f} {model / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Requests per second of the API as the number of uvicorn workers grows.
+
+Each worker count gets a fresh `python main.py` with ENV=prod and WEB_WORKERS=N, so the
+production launch mode (uvloop, httptools, keep-alive) is what gets measured. It is hit
+by concurrent keep-alive clients for a fixed time. Needs a reachable mongo; point
+--path at an endpoint that exercises it.
+
+usage: python -m faire.benchmarks.load_test [--workers 1 2 4] [--path /orders?limit=50]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def wait_until_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http_client:
+        while time.monotonic() < deadline:
+            try:
+                await http_client.get(url, timeout=1)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start within {timeout}s")
+
+
+async def load(url: str, headers: dict, concurrency: int, duration: float) -> tuple:
+    """
+    returns: (completed requests, failed requests)
+    """
+    completed = 0
+    failed = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def client_loop(http_client: httpx.AsyncClient):
+        nonlocal completed, failed
+        while time.monotonic() < deadline:
+            try:
+                response = await http_client.get(url, headers=headers, timeout=30)
+                if response.status_code < 400:
+                    completed += 1
+                else:
+                    failed += 1
+            except httpx.HTTPError:
+                failed += 1
+
+    async with httpx.AsyncClient(limits=limits) as http_client:
+        await asyncio.gather(*(client_loop(http_client) for _ in range(concurrency)))
+    return completed, failed
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, ENV="prod", WEB_WORKERS=str(workers), PORT=str(port))
+    return subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    arg_parser.add_argument("--path", default="/orders?limit=50")
+    arg_parser.add_argument("--port", type=int, default=8099)
+    arg_parser.add_argument("--concurrency", type=int, default=64)
+    arg_parser.add_argument("--duration", type=float, default=15)
+    arg_parser.add_argument("--token", help="bearer token when AUTH_ENABLED is set")
+    args = arg_parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    url = f"http://127.0.0.1:{args.port}{args.path}"
+    print(f"{'workers':>7} {'req/s':>10} {'failed':>8}")
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            asyncio.run(wait_until_ready(f"http://127.0.0.1:{args.port}/"))
+            completed, failed = asyncio.run(
+                load(url, headers, args.concurrency, args.duration)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{workers:>7} {completed / args.duration:>10.1f} {failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
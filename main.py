@@ -1,11 +1,48 @@
+import importlib.util
+import inspect
 import os
 import app
 import uvicorn
+from server.config import BaseConfig, Env
 
-if __name__ == "__main__":
-    uvicorn.run(
-        "app:app",
-        host="0.0.0.0",
-        port=int(os.environ.get("PORT", "8001")),
-        reload=True,
+config = BaseConfig()
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options() -> dict:
+    """
+    uvicorn settings for the configured environment, dev reloads in a single process
+    while prod forks one worker per CPU (or WEB_WORKERS) on uvloop and httptools.
+
+    State shared between workers lives in Mongo: import job progress, webhook event
+    dedupe and the response cache's validity (ETags change with the orders they cover).
+    Still per worker: span timings and the profiler (/admin responses name the pid),
+    the webhook fetch queue, and the schedulers, which run on the worker holding
+    SCHEDULER_LOCK_PATH.
+    """
+    options = {
+        "host": "0.0.0.0",
+        "port": int(os.environ.get("PORT", "8001")),
+    }
+    if config.environment != Env.prod:
+        options["reload"] = True
+        return options
+
+    options.update(
+        workers=config.web_workers or os.cpu_count() or 1,
+        loop="uvloop" if installed("uvloop") else "auto",
+        http="httptools" if installed("httptools") else "auto",
+        timeout_keep_alive=config.keep_alive_seconds,
+        reload=False,
     )
+    # Only newer uvicorn releases accept a graceful shutdown timeout
+    if "timeout_graceful_shutdown" in inspect.signature(uvicorn.Config).parameters:
+        options["timeout_graceful_shutdown"] = config.graceful_shutdown_seconds
+    return options
+
+
+if __name__ == "__main__":
+    uvicorn.run("app:app", **server_options())
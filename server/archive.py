@@ -0,0 +1,334 @@
+"""
+Archive raw Faire order page snapshots and rollup collections to S3, and restore them
+into Mongo so a fresh environment can be rebuilt without a full Faire resync.
+
+Uploads go through boto3's managed transfer (parallel multipart above the chunk size).
+Downloads fetch byte ranges in parallel straight into a temporary file, so memory stays
+bounded by the chunk size times the concurrency. Snapshots are then streamed through the
+incremental import parser and the fast ingest mappers, and rollups are read line by
+line. Set S3_ENDPOINT_URL to run against a local stand-in such as moto_server.
+
+usage:
+    python -m faire.server.archive archive --snapshot orders.json --rollup product_sales_daily
+    python -m faire.server.archive restore --brand yate
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from bson import json_util
+from pymongo import ReplaceOne
+
+from faire.server.config import BaseConfig
+from faire.server.database import engine
+from faire.server.faire_client import FaireClient
+from faire.server.models.order import Order, OrderItem, Shipment
+from faire.server.order_import import IMPORT_CHUNK_SIZE, iter_raw_orders
+from faire.server.order_store import (
+    UPSERT_BATCH_SIZE,
+    bulk_write_batched,
+    ensure_order_indexes,
+)
+from faire.server.product_sales import SALES_COLLECTION, ensure_sales_indexes
+from faire.server.shipments import ensure_shipment_indexes
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+SNAPSHOT_PREFIX = "snapshots"
+ROLLUP_PREFIX = "rollups"
+
+
+def rollup_keys() -> Dict[str, Tuple[str, ...]]:
+    """
+    Natural key of each collection that restore writes to. Restored snapshots give
+    orders, items and shipments new _ids, so their rollups must be matched on these
+    keys instead of _id or every document would be inserted a second time.
+    """
+    return {
+        engine.get_collection(Order).name: ("provider_order_id",),
+        engine.get_collection(OrderItem).name: ("order_item_id",),
+        engine.get_collection(Shipment).name: ("shipment_id",),
+        SALES_COLLECTION: ("product_id", "variant_id", "day"),
+    }
+
+
+def rollup_upsert_op(document: dict, keys: Tuple[str, ...]) -> ReplaceOne:
+    """
+    Replace-or-insert for an archived document, matched on its natural key when the
+    collection has one (dropping the archived _id) and on _id otherwise
+    """
+    if not keys:
+        return ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+    document = dict(document)
+    document.pop("_id", None)
+    return ReplaceOne({key: document.get(key) for key in keys}, document, upsert=True)
+
+
+class OrderArchiver:
+    def __init__(
+        self,
+        bucket: Optional[str] = None,
+        prefix: Optional[str] = None,
+        s3_client=None,
+        chunk_size: int = config.archive_chunk_size,
+        max_concurrency: int = config.archive_max_concurrency,
+    ):
+        self.bucket = bucket or config.archive_bucket
+        self.prefix = (prefix or config.archive_prefix).strip("/")
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.s3 = s3_client or boto3.client(
+            "s3",
+            region_name=config.aws_region,
+            endpoint_url=config.s3_endpoint_url,
+            aws_access_key_id=config.dev_aws_access_key,
+            aws_secret_access_key=config.dev_aws_secret_access_key,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}/{kind}/{name}"
+
+    # * ARCHIVE
+
+    def archive_snapshot(self, path: str, name: Optional[str] = None) -> str:
+        """
+        Upload a raw orders page snapshot file (e.g. orders.json)
+        parameter: local path of the snapshot, optional object name
+        returns: S3 key of the uploaded snapshot
+        """
+        key = self._key(SNAPSHOT_PREFIX, name or os.path.basename(path))
+        self.s3.upload_file(path, self.bucket, key, Config=self.transfer_config)
+        logger.info(f"archived snapshot {path} to s3://{self.bucket}/{key}")
+        return key
+
+    def archive_page(self, page: dict, name: str) -> str:
+        """
+        Upload a raw orders page as returned by the Faire /orders endpoint
+        parameter: page dictionary, object name
+        returns: S3 key of the uploaded page
+        """
+        key = self._key(SNAPSHOT_PREFIX, name)
+        body = io.BytesIO(json.dumps(page).encode("utf-8"))
+        self.s3.upload_fileobj(body, self.bucket, key, Config=self.transfer_config)
+        return key
+
+    async def archive_rollup(self, collection_name: str) -> str:
+        """
+        Dump a Mongo collection as extended JSON lines and upload it
+        parameter: name of the collection in the configured database
+        returns: S3 key of the uploaded rollup
+        """
+        key = self._key(ROLLUP_PREFIX, f"{collection_name}.jsonl")
+        collection = engine.database[collection_name]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as dump:
+            async for document in collection.find():
+                dump.write(json_util.dumps(document))
+                dump.write("\n")
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None,
+                lambda: self.s3.upload_file(
+                    dump.name, self.bucket, key, Config=self.transfer_config
+                ),
+            )
+        finally:
+            os.remove(dump.name)
+        logger.info(f"archived collection {collection_name} to s3://{self.bucket}/{key}")
+        return key
+
+    # * RESTORE
+
+    def list_keys(self, kind: str) -> List[str]:
+        paginator = self.s3.get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=f"{self.prefix}/{kind}/"
+        ):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def _copy_range(self, key: str, byte_range: Tuple[int, int], fd: int):
+        start, end = byte_range
+        response = self.s3.get_object(
+            Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+        os.pwrite(fd, response["Body"].read(), start)
+
+    def download(self, key: str, path: str) -> int:
+        """
+        Download an object to a file, fetching byte ranges in parallel. Each range is
+        written at its offset as it arrives, so at most max_concurrency chunks are held
+        in memory.
+        parameter: S3 key, local path to write to
+        returns: object size in bytes
+        """
+        size = self.s3.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        ranges = [
+            (start, min(start + self.chunk_size, size) - 1)
+            for start in range(0, size, self.chunk_size)
+        ]
+        with open(path, "wb") as f:
+            f.truncate(size)
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                # list() surfaces the first failed range
+                list(pool.map(lambda r: self._copy_range(key, r, f.fileno()), ranges))
+        return size
+
+    def _download_temp(self, key: str) -> str:
+        with tempfile.NamedTemporaryFile(suffix=os.path.basename(key), delete=False) as f:
+            path = f.name
+        try:
+            self.download(key, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    async def _download_all(self, keys: List[str]) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Yield (key, path of the downloaded file) pairs, prefetching the next object
+        while the caller works. Each file is removed once the caller moves on.
+        """
+        loop = asyncio.get_running_loop()
+        pending = None
+        try:
+            for index, key in enumerate(keys):
+                if pending is None:
+                    pending = loop.run_in_executor(None, self._download_temp, key)
+                path = await pending
+                pending = None
+                if index + 1 < len(keys):
+                    pending = loop.run_in_executor(
+                        None, self._download_temp, keys[index + 1]
+                    )
+                try:
+                    yield key, path
+                finally:
+                    os.remove(path)
+        finally:
+            if pending is not None:
+                os.remove(await pending)
+
+    async def restore_snapshots(
+        self, brand: str, batch_size: int = UPSERT_BATCH_SIZE
+    ) -> int:
+        """
+        Stream every archived page snapshot through the fast ingest path and bulk upsert
+        the orders into Mongo. Orders whose stored content hash is unchanged are skipped.
+        parameter: brand to ingest orders for, upsert batch size
+        returns: number of orders written
+        """
+        faire_client = FaireClient(brand)
+        await faire_client.hash_index.reload()
+        written = 0
+        batch = []
+        async for key, path in self._download_all(self.list_keys(SNAPSHOT_PREFIX)):
+            async for raw_order in iter_raw_orders(_file_chunks(path)):
+                batch.append(raw_order)
+                if len(batch) >= batch_size:
+                    written += await faire_client.save_orders_page({"orders": batch})
+                    batch = []
+            logger.info(f"restored snapshot {key}")
+        if batch:
+            written += await faire_client.save_orders_page({"orders": batch})
+        return written
+
+    async def restore_rollups(self, batch_size: int = UPSERT_BATCH_SIZE) -> int:
+        """
+        Load every archived rollup collection back into Mongo, replacing on the
+        collection's natural key (see rollup_keys) or on _id
+        parameter: upsert batch size
+        returns: number of documents written
+        """
+        written = 0
+        keys_by_collection = rollup_keys()
+        async for key, path in self._download_all(self.list_keys(ROLLUP_PREFIX)):
+            collection_name = os.path.basename(key).rsplit(".", 1)[0]
+            keys = keys_by_collection.get(collection_name, ())
+            with open(path, encoding="utf-8") as lines:
+                written += await bulk_write_batched(
+                    engine.database[collection_name],
+                    (
+                        rollup_upsert_op(json_util.loads(line), keys)
+                        for line in lines
+                        if line.strip()
+                    ),
+                    batch_size,
+                )
+            logger.info(f"restored rollup {collection_name}")
+        return written
+
+
+async def _file_chunks(path: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def archive(snapshots: List[str], rollups: List[str]):
+    archiver = OrderArchiver()
+    for path in snapshots:
+        await asyncio.get_running_loop().run_in_executor(
+            None, archiver.archive_snapshot, path
+        )
+    for collection_name in rollups:
+        await archiver.archive_rollup(collection_name)
+
+
+async def restore(brand: str, batch_size: int, skip_rollups: bool):
+    archiver = OrderArchiver()
+    # Restore upserts on natural keys, which need their unique indexes to be fast and
+    # to keep a rerun from duplicating documents
+    await ensure_order_indexes()
+    await ensure_sales_indexes()
+    await ensure_shipment_indexes()
+    orders_written = await archiver.restore_snapshots(brand, batch_size)
+    logger.info(f"restored {orders_written} orders")
+    if not skip_rollups:
+        documents_written = await archiver.restore_rollups(batch_size)
+        logger.info(f"restored {documents_written} rollup documents")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = commands.add_parser("archive", help="push snapshots and rollups to S3")
+    archive_parser.add_argument("--snapshot", action="append", default=[])
+    archive_parser.add_argument("--rollup", action="append", default=[])
+
+    restore_parser = commands.add_parser("restore", help="load S3 archive into Mongo")
+    restore_parser.add_argument("--brand", default="yate")
+    restore_parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    restore_parser.add_argument("--skip-rollups", action="store_true")
+
+    args = arg_parser.parse_args()
+    if args.command == "archive":
+        asyncio.run(archive(args.snapshot, args.rollup))
+    else:
+        asyncio.run(restore(args.brand, args.batch_size, args.skip_rollups))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+JWT authentication for the API with cached verification.
+
+Verified claims are kept in an LRU keyed by the SHA-256 of the token and expire at the
+token's exp, so a client reusing its token pays for signature verification once.
+RS/ES tokens are checked against a JWKS that is fetched once and cached for a TTL
+(refetched early only when an unknown kid shows up); HS tokens use the shared secret.
+The brand claim becomes the request's brand scope, which every order query filters on.
+Admin routes and the order import also need the admin claim, and data that is not keyed
+by brand (the sales rollup, imports) is limited to the brand this server syncs. A JWKS
+outage is reported as AuthUnavailable (503) rather than an invalid token; keys already
+cached keep working while it lasts, and a failed fetch is not retried for
+JWKS_RETRY_SECONDS so requests do not queue up behind one timeout after another.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+import jwt
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from faire.server.config import BaseConfig
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+# Minimum time between JWKS refetches triggered by unknown key ids
+UNKNOWN_KID_REFETCH_SECONDS = 30
+# Minimum time between JWKS fetch attempts after a failed one
+JWKS_RETRY_SECONDS = 5
+
+
+class AuthError(Exception):
+    pass
+
+
+class AuthUnavailable(Exception):
+    """Token verification could not run, e.g. the JWKS endpoint is down"""
+
+
+class TokenCache:
+    """LRU of verified claims keyed by token hash, entries expire with the token"""
+
+    def __init__(self, max_size: int, max_ttl_seconds: float):
+        self.max_size = max_size
+        self.max_ttl_seconds = max_ttl_seconds
+        self.entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, key: bytes, claims: dict):
+        expires_at = time.time() + self.max_ttl_seconds
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self.lock:
+            self.entries[key] = (claims, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SigningKeyCache:
+    """JWKS signing keys by kid, fetched asynchronously and cached for a TTL"""
+
+    def __init__(self, jwks_url: Optional[str], ttl_seconds: float):
+        self.jwks_url = jwks_url
+        self.ttl_seconds = ttl_seconds
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.fetched_at = 0.0
+        # Last fetch attempt, successful or not, and why it failed
+        self.attempted_at = 0.0
+        self.error: Optional[str] = None
+        self.lock = asyncio.Lock()
+
+    async def _refresh(self):
+        """
+        raises: AuthUnavailable when the JWKS cannot be fetched or parsed
+        """
+        try:
+            async with httpx.AsyncClient() as http_client:
+                response = await http_client.get(self.jwks_url, timeout=10)
+                response.raise_for_status()
+            key_set = jwt.PyJWKSet.from_dict(response.json())
+        except (httpx.HTTPError, ValueError, jwt.PyJWTError) as e:
+            raise AuthUnavailable(f"Could not fetch signing keys: {e}")
+        self.keys = {key.key_id: key for key in key_set.keys}
+        self.fetched_at = time.monotonic()
+
+    def _refresh_due(self, kid: Optional[str]) -> bool:
+        now = time.monotonic()
+        if self.error is not None and now - self.attempted_at < JWKS_RETRY_SECONDS:
+            return False
+        age = now - self.fetched_at
+        unknown = kid not in self.keys
+        return age > self.ttl_seconds or (unknown and age > UNKNOWN_KID_REFETCH_SECONDS)
+
+    async def get(self, kid: Optional[str]):
+        """
+        returns: the signing key for kid
+        raises: AuthError for an unknown kid, AuthUnavailable when the kid is not
+            cached and the JWKS could not be fetched
+        """
+        if not self.jwks_url:
+            raise AuthError("No JWKS configured for asymmetric tokens")
+        if self._refresh_due(kid):
+            attempted_at = self.attempted_at
+            async with self.lock:
+                # Another request may have tried while we waited for the lock, its
+                # outcome (keys or error) answers this one too
+                if self.attempted_at == attempted_at:
+                    try:
+                        await self._refresh()
+                        self.error = None
+                    except AuthUnavailable as e:
+                        self.error = str(e)
+                        logger.warning(f"{e}, using cached signing keys")
+                    finally:
+                        self.attempted_at = time.monotonic()
+        key = self.keys.get(kid)
+        if key is None:
+            if self.error is not None:
+                raise AuthUnavailable(self.error)
+            raise AuthError(f"Unknown signing key {kid}")
+        return key.key
+
+
+class Authenticator:
+    def __init__(self, token_cache: Optional[TokenCache], signing_keys: SigningKeyCache):
+        self.token_cache = token_cache
+        self.signing_keys = signing_keys
+        self.algorithms = config.jwt_algorithms.split(",")
+
+    async def _signing_key(self, token: str):
+        header = jwt.get_unverified_header(token)
+        if header.get("alg", "").startswith("HS"):
+            if not config.jwt_secret:
+                raise AuthError("No secret configured for HMAC tokens")
+            return config.jwt_secret
+        return await self.signing_keys.get(header.get("kid"))
+
+    async def verify(self, token: str) -> dict:
+        """
+        Verify a bearer token, using the token cache when enabled
+        returns: token claims
+        raises: AuthError when the token is invalid or expired
+        """
+        key = TokenCache.key(token) if self.token_cache else None
+        if key is not None:
+            claims = self.token_cache.get(key)
+            if claims is not None:
+                return claims
+        try:
+            claims = jwt.decode(
+                token,
+                await self._signing_key(token),
+                algorithms=self.algorithms,
+                audience=config.jwt_audience or None,
+                issuer=config.jwt_issuer or None,
+                options={"verify_aud": bool(config.jwt_audience)},
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(str(e))
+        if key is not None:
+            self.token_cache.put(key, claims)
+        return claims
+
+
+authenticator = Authenticator(
+    token_cache=TokenCache(
+        max_size=config.auth_token_cache_size,
+        max_ttl_seconds=config.auth_token_cache_ttl_seconds,
+    )
+    if config.auth_token_cache_size
+    else None,
+    signing_keys=SigningKeyCache(config.jwks_url, config.jwks_cache_ttl_seconds),
+)
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
+
+
+def brand_scope(request: Request) -> Optional[str]:
+    """
+    FastAPI dependency returning the authenticated brand, or None when auth is disabled
+    """
+    return getattr(request.state, "brand", None)
+
+
+async def authenticate_request(
+    request: Request, verifier: Optional[Authenticator] = None
+) -> Optional[JSONResponse]:
+    """
+    Verify the bearer token and attach the caller's brand scope and admin flag to the
+    request
+    parameter: incoming request, authenticator to use (the shared one by default)
+    returns: the 401/403/503 response to send instead, or None when the request may
+        proceed
+    """
+    token = bearer_token(request)
+    if not token:
+        return JSONResponse(
+            status_code=401,
+            content={"detail": "Missing bearer token"},
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        claims = await (verifier or authenticator).verify(token)
+    except AuthError as e:
+        return JSONResponse(
+            status_code=401,
+            content={"detail": f"Invalid token: {e}"},
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except AuthUnavailable as e:
+        logger.error(f"token verification unavailable: {e}")
+        return JSONResponse(
+            status_code=503, content={"detail": "Authentication temporarily unavailable"}
+        )
+    brand = claims.get(config.jwt_brand_claim)
+    if not brand:
+        return JSONResponse(
+            status_code=403, content={"detail": "Token has no brand scope"}
+        )
+    request.state.brand = brand
+    request.state.admin = is_admin(claims)
+    return None
+
+
+def is_admin(claims: dict) -> bool:
+    return claims.get(config.jwt_admin_claim) is True
+
+
+def require_admin(request: Request):
+    """
+    FastAPI dependency rejecting callers without the admin claim when auth is enabled
+    """
+    if config.auth_enabled and not getattr(request.state, "admin", False):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def synced_brand_scope(brand: str):
+    """
+    Build a dependency for data that is not keyed by brand, only the brand this server
+    syncs may read it
+    parameter: brand of the server's FaireClient
+    """
+
+    def dependency(request: Request) -> Optional[str]:
+        scope = brand_scope(request)
+        if scope is not None and scope != brand:
+            raise HTTPException(
+                status_code=403, detail=f"Not available for brand {scope}"
+            )
+        return scope
+
+    return dependency
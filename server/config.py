@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic import BaseSettings
 from enum import Enum
 from dotenv.main import load_dotenv
@@ -14,22 +15,122 @@ class BaseConfig(BaseSettings):
     load_dotenv()
     mongo_details: str = os.getenv("MONGO_DETAILS")
     database: str = "faire-data"
+    # Per process; every uvicorn worker has its own pool
+    mongo_max_pool_size: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    mongo_min_pool_size: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+    mongo_max_idle_time_ms: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
 
     dev_aws_access_key: str = os.getenv("DEV_AWS_ACCESS_KEY")
     dev_aws_secret_access_key: str = os.getenv("DEV_SECRET_ACCESS_KEY")
 
+    # s3 archive
+    aws_region: str = os.getenv("AWS_REGION", "us-east-1")
+    # Point at a local S3 stand-in (e.g. moto_server) for development
+    s3_endpoint_url: Optional[str] = os.getenv("S3_ENDPOINT_URL")
+    archive_bucket: str = os.getenv("ARCHIVE_BUCKET", "faire-data-archive")
+    archive_prefix: str = os.getenv("ARCHIVE_PREFIX", "faire-data")
+    archive_chunk_size: int = int(os.getenv("ARCHIVE_CHUNK_SIZE", 8 * 1024 * 1024))
+    archive_max_concurrency: int = int(os.getenv("ARCHIVE_MAX_CONCURRENCY", "10"))
+
     # faire
     # Define the API endpoint and key
     faire_url = "https://www.faire.com/external-api/v2"
     faire_api_key: str = os.getenv("X-FAIRE-ACCESS-TOKEN")
 
+    faire_http_max_connections: int = int(os.getenv("FAIRE_HTTP_MAX_CONNECTIONS", "20"))
+    faire_http_max_keepalive: int = int(os.getenv("FAIRE_HTTP_MAX_KEEPALIVE", "10"))
+    faire_http_timeout_seconds: float = float(os.getenv("FAIRE_HTTP_TIMEOUT_SECONDS", "30"))
+
     # Set up authentication headers
     faire_auth_headers = {
         "Content-Type": "application/json",
         "X-FAIRE-ACCESS-TOKEN": faire_api_key,
     }
 
+    # ingest
+    # Map raw orders straight to documents on sync instead of building Order models
+    fast_ingest: bool = os.getenv("FAST_INGEST", "true").lower() == "true"
+    # Fraction of fast ingested orders that still get full model validation
+    ingest_validation_sample_rate: float = float(
+        os.getenv("INGEST_VALIDATION_SAMPLE_RATE", "0.01")
+    )
+
+    # api
+    response_cache_max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+    response_cache_max_bytes: int = int(
+        os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    )
+
+    # profiling
+    timing_spans: bool = os.getenv("TIMING_SPANS", "false").lower() == "true"
+    # Sample stacks for this many seconds after startup, 0 disables
+    profile_seconds: int = int(os.getenv("PROFILE_SECONDS", "0"))
+    profile_interval_ms: int = int(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    profile_dir: str = os.getenv("PROFILE_DIR", "profiles")
+
+    # webhooks
+    faire_webhook_secret: str = os.getenv("FAIRE_WEBHOOK_SECRET", "")
+    # Events for the same order within this window become one get_order call
+    webhook_coalesce_seconds: float = float(os.getenv("WEBHOOK_COALESCE_SECONDS", "2"))
+    webhook_fetch_concurrency: int = int(os.getenv("WEBHOOK_FETCH_CONCURRENCY", "4"))
+    webhook_dedupe_ttl_seconds: float = float(
+        os.getenv("WEBHOOK_DEDUPE_TTL_SECONDS", 24 * 60 * 60)
+    )
+    # Incremental /orders poll that backs up the webhooks, 0 disables
+    consistency_poll_seconds: float = float(os.getenv("CONSISTENCY_POLL_SECONDS", "3600"))
+
+    # shipment tracking refresh, 0 disables
+    shipment_refresh_seconds: float = float(os.getenv("SHIPMENT_REFRESH_SECONDS", "900"))
+    shipment_refresh_batch_size: int = int(os.getenv("SHIPMENT_REFRESH_BATCH_SIZE", "20"))
+    shipment_refresh_max_orders: int = int(
+        os.getenv("SHIPMENT_REFRESH_MAX_ORDERS", "1000")
+    )
+    shipment_refresh_concurrency: int = int(
+        os.getenv("SHIPMENT_REFRESH_CONCURRENCY", "4")
+    )
+
+    # auth
+    auth_enabled: bool = os.getenv("AUTH_ENABLED", "false").lower() == "true"
+    jwt_algorithms: str = os.getenv("JWT_ALGORITHMS", "RS256")
+    jwt_secret: str = os.getenv("JWT_SECRET", "")
+    jwt_audience: str = os.getenv("JWT_AUDIENCE", "")
+    jwt_issuer: str = os.getenv("JWT_ISSUER", "")
+    jwks_url: Optional[str] = os.getenv("JWKS_URL")
+    jwks_cache_ttl_seconds: float = float(os.getenv("JWKS_CACHE_TTL_SECONDS", "3600"))
+    jwt_brand_claim: str = os.getenv("JWT_BRAND_CLAIM", "brand")
+    # Tokens with this claim set to true may use /admin and the order import
+    jwt_admin_claim: str = os.getenv("JWT_ADMIN_CLAIM", "admin")
+    # Verified token cache, size 0 disables it
+    auth_token_cache_size: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+    auth_token_cache_ttl_seconds: float = float(
+        os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "300")
+    )
+
+    # server, web_workers 0 means one per CPU in prod
+    web_workers: int = int(os.getenv("WEB_WORKERS", "0"))
+    graceful_shutdown_seconds: int = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+    keep_alive_seconds: int = int(os.getenv("KEEP_ALIVE_SECONDS", "5"))
+    # Only the worker holding this lock runs the consistency poll and shipment refresher
+    scheduler_lock_path: str = os.getenv("SCHEDULER_LOCK_PATH", "/tmp/faire-scheduler.lock")
+
     # * INTEGRATIONS
     slack_api_key: str = ""
+    # Point at a local stand-in to exercise notifications without Slack
+    slack_api_url: str = os.getenv("SLACK_API_URL", "https://slack.com/api")
+    # Backorder and cancellation digests go to the orders channel unless set
+    slack_orders_channel: str = os.getenv("SLACK_ORDERS_CHANNEL", "")
+    slack_backorders_channel: str = os.getenv("SLACK_BACKORDERS_CHANNEL", "")
+    slack_cancellations_channel: str = os.getenv("SLACK_CANCELLATIONS_CHANNEL", "")
+    # Order events within this window are sent as one digest per channel
+    slack_digest_seconds: float = float(os.getenv("SLACK_DIGEST_SECONDS", "30"))
+    # Events past this many are only counted in the next digest
+    slack_buffer_size: int = int(os.getenv("SLACK_BUFFER_SIZE", "1000"))
+    slack_digest_max_lines: int = int(os.getenv("SLACK_DIGEST_MAX_LINES", "20"))
+    slack_max_retries: int = int(os.getenv("SLACK_MAX_RETRIES", "3"))
+    # Orders first seen after this age (e.g. in a backfill) are not announced as new
+    slack_new_order_max_age_hours: float = float(
+        os.getenv("SLACK_NEW_ORDER_MAX_AGE_HOURS", "24")
+    )
 
     environment: Env = os.getenv("ENV", "dev")
+
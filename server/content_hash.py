@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from faire.server.database import engine
+from faire.server.models.order import Order
+
+# Bump whenever what ingest derives from an order changes (search_tokens, items,
+# shipments, brand) so every order hashes differently and the next sync rewrites them
+INGEST_VERSION = 6
+
+
+def content_hash(raw_order: dict) -> int:
+    """
+    Stable 64 bit hash of a raw Faire order dictionary.
+    Keys are sorted and whitespace removed first so the hash only changes when the data does.
+    parameter: raw order dictionary as returned by the Faire API
+    returns: signed 64 bit integer (fits a BSON int64)
+    """
+    canonical = json.dumps(
+        raw_order, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+    digest = hashlib.blake2b(
+        f"{INGEST_VERSION}:".encode("ascii") + canonical, digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class OrderHashIndex:
+    """
+    In memory map of provider_order_id to the content hash stored on the order document.
+    Reloaded at the start of every sync so unchanged orders can be skipped before
+    parsing. Other workers, imports and restores write orders without updating this
+    copy, so it is never trusted across syncs.
+    """
+
+    def __init__(self):
+        self.hashes: Dict[str, int] = {}
+        self.lock = asyncio.Lock()
+
+    async def reload(self):
+        """Load the stored hashes, concurrent syncs share one load"""
+        if self.lock.locked():
+            async with self.lock:
+                return
+        async with self.lock:
+            await self.load()
+
+    async def load(self):
+        collection = engine.get_collection(Order)
+        cursor = collection.find(
+            {"content_hash": {"$ne": None}},
+            projection={"_id": 0, "provider_order_id": 1, "content_hash": 1},
+        )
+        hashes = {}
+        async for document in cursor:
+            hashes[document["provider_order_id"]] = document["content_hash"]
+        self.hashes = hashes
+
+    async def refresh(self, provider_order_ids: List[str]):
+        """Re-read the stored hashes of a few orders, e.g. before a single order fetch"""
+        collection = engine.get_collection(Order)
+        cursor = collection.find(
+            {"provider_order_id": {"$in": provider_order_ids}},
+            projection={"_id": 0, "provider_order_id": 1, "content_hash": 1},
+        )
+        stored = {
+            document["provider_order_id"]: document.get("content_hash")
+            async for document in cursor
+        }
+        for provider_order_id in provider_order_ids:
+            if stored.get(provider_order_id) is None:
+                self.hashes.pop(provider_order_id, None)
+            else:
+                self.hashes[provider_order_id] = stored[provider_order_id]
+
+    def is_unchanged(self, provider_order_id: str, order_hash: int) -> bool:
+        return self.hashes.get(provider_order_id) == order_hash
+
+    def get(self, provider_order_id: str) -> Optional[int]:
+        return self.hashes.get(provider_order_id)
+
+    def record(self, orders: Iterable[Order]):
+        """Remember the hashes of orders that were just written"""
+        for order in orders:
+            if order.content_hash is not None:
+                self.hashes[order.provider_order_id] = order.content_hash
+
+    def record_documents(self, documents: Iterable[dict]):
+        """Remember the hashes of order documents that were just written"""
+        for document in documents:
+            if document.get("content_hash") is not None:
+                self.hashes[document["provider_order_id"]] = document["content_hash"]
@@ -1,3 +1,4 @@
+import asyncio
 import motor.motor_asyncio
 from odmantic import AIOEngine
 from faire.server.config import BaseConfig
@@ -5,12 +6,30 @@ from faire.server.config import BaseConfig
 config = BaseConfig()
 MONGO_DETAILS = config.mongo_details
 
+POOL_OPTIONS = {
+    "maxPoolSize": config.mongo_max_pool_size,
+    "minPoolSize": config.mongo_min_pool_size,
+    "maxIdleTimeMS": config.mongo_max_idle_time_ms,
+}
+
 try:
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS, **POOL_OPTIONS)
 
 except ConnectionError:
     print("USING LOCAL!!")
     client = motor.motor_asyncio.AsyncIOMotorClient(
-       "mongodb+srv://czero:<password>@faire-data.r6pe0wu.mongodb.net/?retryWrites=true&w=majority")
+       "mongodb+srv://czero:<password>@faire-data.r6pe0wu.mongodb.net/?retryWrites=true&w=majority",
+       **POOL_OPTIONS)
 engine = AIOEngine(client=client, database=config.database)
+
+
+async def warm_pool():
+    """Open min pool size connections up front so the first requests skip the handshake"""
+    await asyncio.gather(
+        *(client.admin.command("ping") for _ in range(max(config.mongo_min_pool_size, 1)))
+    )
+
+
+def close_pool():
+    client.close()
 database = "faire-data"
\ No newline at end of file
@@ -70,7 +70,7 @@ def parse_order_items(items: [{}]) -> List[OrderItem]:
                 updated_at=item["updated_at"],
                 discounts=item["discounts"],
             )
-        item_list.append(new_item)
+            item_list.append(new_item)
     return item_list
 
 
@@ -200,6 +200,7 @@ async def parse_orders(order_data) -> List[Order]:
         item_id_list = []
         shipment_id_list = []
         brand_discounts_list = []  # TODO Get discount models and add to list
+        new_payout_costs = None
         item_list = []
         shipment_list = []
 
@@ -234,10 +235,7 @@ async def parse_orders(order_data) -> List[Order]:
             state=state,
             address=new_address,
             ship_after=ship_after,
-            payout_costs=Cost(
-                amount_minor=payout_costs.get("amount_minor"),
-                currency=payout_costs.get("currency"),
-            ),
+            payout_costs=new_payout_costs,
             payment_initiated_at=payment_initiated_at,
             original_order_id=original_order_id,
             retailer_id=retailer_id,
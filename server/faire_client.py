@@ -1,21 +1,47 @@
 import traceback
+from contextlib import asynccontextmanager
 
-from config import BaseConfig
-from typing import List
+from faire.server.config import BaseConfig
+from typing import List, Tuple
 import requests
 import json
-from models.order import *
+from faire.server.models.order import *
 from pymongo import MongoClient
 from dateutil import parser
-from database import client, database
+from faire.server.content_hash import OrderHashIndex, content_hash
+from faire.server.database import client, database
+from faire.server.ingest import ingest_order, ingest_order_items, ingest_order_shipments
+from faire.server.notifications import order_notifier
+from faire.server.order_store import (
+    split_stale,
+    stored_update_times,
+    upsert_newer_order_documents,
+    upsert_order_documents,
+    upsert_orders,
+)
 from odmantic import AIOEngine
-from parameters import GetOrdersParams
+from faire.server.parameters import GetOrdersParams
+from faire.server.product_sales import upsert_order_items
+from faire.server.profiling import span
+from faire.server.shipments import upsert_shipments
+from faire.server.search import order_search_tokens
 import httpx
 
 config = BaseConfig()
 engine = AIOEngine(client=client, database=config.database)
 
 
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an optional Faire timestamp
+    parameter: ISO 8601 string or None
+    returns: datetime, or None when the field is missing
+    """
+    if not value:
+        return None
+    return parser.parse(value)
+
+
 class FaireClient:
     def __init__(self, brand: str):
         self.brand = brand
@@ -24,6 +50,29 @@ class FaireClient:
         self.faire_admin_api_key: str = config.faire_api_key  # brand.shop_url
         self.auth_headers = config.faire_auth_headers
         self.version = "2023-06"
+        self.hash_index = OrderHashIndex()
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Shared, pooled http client for faire requests. It stays open between requests
+        so connections are reused; aclose() releases it at shutdown.
+        """
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.faire_http_max_connections,
+                    max_keepalive_connections=config.faire_http_max_keepalive,
+                ),
+                timeout=config.faire_http_timeout_seconds,
+            )
+        yield self._http_client
+
+    async def aclose(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
 
     async def get_all_orders(
         self, params: GetOrdersParams = GetOrdersParams()
@@ -36,25 +85,34 @@ class FaireClient:
         Returns: List of Order Models
         """
         order_models = []
-        async with httpx.AsyncClient as faire_client:
+        await self.hash_index.reload()
+        async with self.session() as faire_client:
             try:
                 if not params.page:
-                    response = faire_client.get(
-                        f"{self.shop_url}/orders",
-                        headers=self.auth_headers,
-                        params=params.get_orders_params_dict(),
-                    )
-                    orders_json = response.json()
-                    order_models = self.parse_orders_json(orders_json)
+                    with span("sync.fetch"):
+                        response = await faire_client.get(
+                            f"{self.shop_url}/orders",
+                            headers=self.auth_headers,
+                            params=params.get_orders_params_dict(),
+                        )
+                        orders_json = response.json()
+                    with span("sync.parse"):
+                        order_models = self.parse_orders_json(orders_json)
+                    with span("sync.persist"):
+                        await self.save_order_models(orders_json, order_models)
                 else:
                     # TODO Handle page input differently?
-                    response = requests.get(
-                        f"{self.shop_url}/orders",
-                        headers=self.auth_headers,
-                        params=params.get_orders_params_dict(),
-                    )
-                    orders_json = response.json()
-                    order_models = self.parse_orders_json(orders_json)
+                    with span("sync.fetch"):
+                        response = requests.get(
+                            f"{self.shop_url}/orders",
+                            headers=self.auth_headers,
+                            params=params.get_orders_params_dict(),
+                        )
+                        orders_json = response.json()
+                    with span("sync.parse"):
+                        order_models = self.parse_orders_json(orders_json)
+                    with span("sync.persist"):
+                        await self.save_order_models(orders_json, order_models)
 
             except ConnectionError:
                 raise Exception("Could not connect to API Endpoint")
@@ -66,13 +124,159 @@ class FaireClient:
 
             return order_models
 
-    async def get_order(self, brand_order_id: str) -> Order:
-        async with httpx.AsyncClient as faire_client:
+    async def sync_orders(self, params: GetOrdersParams = GetOrdersParams()) -> int:
+        """
+        Hot path sync of a page of orders into mongo.
+        Uses the fast ingest mappers instead of Order models when config.fast_ingest is set
+        Parameters: GetOrdersParams for the page to request
+        Returns: number of orders written
+        """
+        if not config.fast_ingest:
+            return len(await self.get_all_orders(params))
+        await self.hash_index.reload()
+        return await self.save_orders_page(await self.fetch_orders_page(params))
+
+    async def sync_all_orders(self, params: Optional[GetOrdersParams] = None) -> int:
+        """
+        Sync every page of orders matching params, starting at params.page
+        Parameters: GetOrdersParams, e.g. with updated_at_min for an incremental sync
+        Returns: number of orders written
+        """
+        written = 0
+        params = params or GetOrdersParams()
+        params.page = params.page or 1
+        await self.hash_index.reload()
+        while True:
+            orders_json = await self.fetch_orders_page(params)
+            if config.fast_ingest:
+                written += await self.save_orders_page(orders_json)
+            else:
+                order_models = self.parse_orders_json(orders_json)
+                written += await self.save_order_models(orders_json, order_models)
+            if len(orders_json.get("orders", [])) < params.limit:
+                return written
+            params.page += 1
+
+    async def fetch_orders_page(self, params: GetOrdersParams) -> dict:
+        """
+        Request a single raw page of orders from faire
+        Parameters: GetOrdersParams for the page to request
+        Returns: raw orders page dictionary
+        """
+        async with self.session() as faire_client:
             try:
-                response = faire_client.get(f"{self.shop_url}/orders/{brand_order_id}",
-                                            headers=self.auth_headers)
+                with span("sync.fetch"):
+                    response = await faire_client.get(
+                        f"{self.shop_url}/orders",
+                        headers=self.auth_headers,
+                        params=params.get_orders_params_dict(),
+                    )
+                    return response.json()
+            except ConnectionError:
+                raise Exception("Could not connect to API Endpoint")
+
+    async def save_orders_page(self, orders_json: dict) -> int:
+        """
+        Fast ingest and persist a raw page of orders, skipping unchanged orders
+        Parameters: raw orders page dictionary
+        Returns: number of orders written
+        """
+        with span("sync.ingest"):
+            documents = self.ingest_orders_json(orders_json)
+        written_ids = {document["provider_order_id"] for document in documents}
+        with span("sync.persist"):
+            previous_states = await order_notifier.previous_states(list(written_ids))
+            written_orders = await self.save_order_children(
+                orders_json["orders"], written_ids
+            )
+            # The order carries the content hash, so it is written only once its
+            # children are; a failed child write leaves the order to be retried
+            written = await upsert_order_documents(documents)
+        self.hash_index.record_documents(documents)
+        order_notifier.notify_orders(written_orders, previous_states)
+        return written
+
+    async def save_newer_order_documents(
+        self, raw_orders: List[dict], documents: List[dict]
+    ) -> Tuple[int, List[str]]:
+        """
+        Persist order documents from a dump, skipping orders whose stored copy was
+        updated more recently (e.g. by a sync since the dump was taken)
+        Parameters: raw order dictionaries, documents ingested from them
+        Returns: (number of orders written, provider_order_ids skipped as stale)
+        """
+        stored = await stored_update_times(
+            [document["provider_order_id"] for document in documents]
+        )
+        fresh, stale = split_stale(documents, stored)
+        written_ids = {document["provider_order_id"] for document in fresh}
+        previous_states = await order_notifier.previous_states(list(written_ids))
+        written_orders = await self.save_order_children(raw_orders, written_ids)
+        # Conditional as well, a sync may have written the order since it was checked
+        written, lost = await upsert_newer_order_documents(fresh)
+        lost_ids = set(lost)
+        self.hash_index.record_documents(
+            document for document in fresh if document["provider_order_id"] not in lost_ids
+        )
+        order_notifier.notify_orders(
+            [order for order in written_orders if order["id"] not in lost_ids],
+            previous_states,
+        )
+        return written, stale + lost
+
+    async def save_order_models(self, orders_json: dict, order_models: List[Order]) -> int:
+        """
+        Persist parsed orders of a raw page together with their items and shipments
+        Parameters: raw orders page dictionary, Order models parsed from it
+        Returns: number of orders written
+        """
+        written_ids = {order.provider_order_id for order in order_models}
+        previous_states = await order_notifier.previous_states(list(written_ids))
+        written_orders = await self.save_order_children(orders_json["orders"], written_ids)
+        written = await upsert_orders(order_models)
+        self.hash_index.record(order_models)
+        order_notifier.notify_orders(written_orders, previous_states)
+        return written
+
+    async def save_order_children(
+        self, raw_orders: List[dict], written_ids: set
+    ) -> List[dict]:
+        """
+        Persist the items and shipments of the raw orders about to be written. Runs
+        before the orders themselves, whose content hash marks them as synced
+        Parameters: raw order dictionaries, provider order ids being written
+        Returns: the raw orders whose children were written
+        """
+        written_orders = [order for order in raw_orders if order["id"] in written_ids]
+        await upsert_order_items(
+            [item for order in written_orders for item in ingest_order_items(order)]
+        )
+        await upsert_shipments(
+            [
+                shipment
+                for order in written_orders
+                for shipment in ingest_order_shipments(order)
+            ]
+        )
+        return written_orders
+
+    async def get_order(self, brand_order_id: str) -> Optional[Order]:
+        """
+        Fetch a single order and persist it unless its content hash is unchanged
+        Parameters: Faire order id
+        Returns: the parsed Order, or None when it is unchanged since the last sync
+        """
+        async with self.session() as faire_client:
+            try:
+                response = await faire_client.get(f"{self.shop_url}/orders/{brand_order_id}",
+                                                  headers=self.auth_headers)
                 order_json = response.json()
-                order_model = self.parse_order(order_json)
+                order_hash = content_hash(order_json)
+                await self.hash_index.refresh([order_json["id"]])
+                order_model = None
+                if not self.hash_index.is_unchanged(order_json["id"], order_hash):
+                    order_model = self.parse_order(order_json, order_hash)
+                    await self.save_order_models({"orders": [order_json]}, [order_model])
 
             except ConnectionError:
                 raise Exception("Could not connect to API Endpoint")
@@ -82,30 +286,36 @@ class FaireClient:
                     f"\ntraceback:{traceback.format_exception(e)}"
                 )
 
-    def parse_order(self, order: {}) -> Order:
+            return order_model
+
+    def parse_order(self, order: {}, order_hash: Optional[int] = None) -> Order:
         """
         Go through an order dictionary and convert to an order model
-        parameter: a single order dictionary to parse
+        parameter: a single order dictionary to parse, its content hash if already computed
         returns: a single Order model
         """
         # Extract relevant information from the order data
         order_id = order["id"]
-        customer = Customer(
-            first_name=order["customer"]["first_name"],
-            last_name=order["customer"]["last_name"],
-        )
+        with span("parse.customer"):
+            customer = Customer(
+                first_name=order["customer"]["first_name"],
+                last_name=order["customer"]["last_name"],
+            )
         display_id = order["display_id"]
-        created_at = parser.parse(order["created_at"])
-        updated_at = parser.parse(order["updated_at"])
+        with span("parse.dates"):
+            created_at = parser.parse(order["created_at"])
+            updated_at = parser.parse(order["updated_at"])
+            ship_after = parser.parse(order["ship_after"])
+            payment_initiated_at = parse_datetime(order.get("payment_initiated_at"))
+            expected_ship_date = parse_datetime(order.get("expected_ship_date"))
+            processing_at = parse_datetime(order.get("processing_at"))
         state = order["state"]
-        address = self.parse_address(order["address"])
-        ship_after = parser.parse(order["ship_after"])
-        payout_costs = self.parse_payout_costs(order["payout_costs"])
-        payment_initiated_at = parser.parse(order.get("payment_initiated_at"))
+        with span("parse.address"):
+            address = self.parse_address(order["address"])
+        with span("parse.payout"):
+            payout_costs = self.parse_payout_costs(order["payout_costs"])
         retailer_id = order["retailer_id"]
         source = order["source"]
-        expected_ship_date = parser.parse(order.get("expected_ship_date"))
-        processing_at = parser.parse(order["processing_at"])
         items_dict = order["items"]
         shipments_dict = order["shipments"]
         brand_discounts_dict = order["brand_discounts"]
@@ -122,19 +332,23 @@ class FaireClient:
 
         # Parse through items
         if items_dict:
-            item_list = self.parse_order_items(items_dict)
+            with span("parse.items"):
+                item_list = self.parse_order_items(items_dict)
             for item in item_list:
                 item_id_list.append(item.order_item_id)
 
         if shipments_dict:
-            shipment_list = self.parse_order_shipments(shipments_dict)
+            with span("parse.shipments"):
+                shipment_list = self.parse_order_shipments(shipments_dict)
             for shipment in shipment_list:
                 shipment_id_list.append(shipment.shipment_id)
 
         if brand_discounts_dict:
-            brand_discounts_list = self.parse_promotions(brand_discounts_dict)
-        if payout_costs:
-            new_payout_costs = self.parse_payout_costs(payout_costs)
+            with span("parse.promotions"):
+                brand_discounts_list = self.parse_promotions(brand_discounts_dict)
+
+        with span("parse.search_tokens"):
+            search_tokens = order_search_tokens(order)
 
         new_order = Order(
             provider_order_id=order_id,
@@ -144,26 +358,49 @@ class FaireClient:
             state=state,
             address=address,
             ship_after=ship_after,
-            payout_costs=new_payout_costs,
+            payout_costs=payout_costs,
             payment_initiated_at=payment_initiated_at,
             original_order_id=original_order_id,
             retailer_id=retailer_id,
             expected_ship_date=expected_ship_date,
             processing_at=processing_at,
             customer=customer,
-            item_ids=item_id_list,
+            order_item_ids=item_id_list,
             shipment_ids=shipment_id_list,
             brand_discounts=brand_discounts_list,
             source=source,
+            brand=self.brand,
+            content_hash=order_hash if order_hash is not None else content_hash(order),
+            search_tokens=search_tokens,
         )
-        order_in_db = await engine.save(new_order, insert=False)
         return new_order
 
-    async def parse_orders_json(self, orders_json: json) -> List[Order]:
+    def parse_orders_json(self, orders_json: json) -> List[Order]:
         # Parse the response JSON
         # Process the order data as needed
+        # Orders whose content hash matches the loaded hash index are unchanged
+        # since the last sync and are neither parsed nor written again
+        order_models = []
+        for order in orders_json["orders"]:
+            order_hash = content_hash(order)
+            if self.hash_index.is_unchanged(order["id"], order_hash):
+                continue
+            order_models.append(self.parse_order(order, order_hash))
+        return order_models
+
+    def ingest_orders_json(self, orders_json: json) -> List[dict]:
+        """
+        Map a page of raw orders to BSON ready documents, skipping unchanged orders
+        parameter: orders page dictionary from the Faire API
+        returns: list of order documents
+        """
+        documents = []
         for order in orders_json["orders"]:
-            self.parse_order(order)
+            order_hash = content_hash(order)
+            if self.hash_index.is_unchanged(order["id"], order_hash):
+                continue
+            documents.append(ingest_order(order, order_hash, brand=self.brand))
+        return documents
 
     def parse_promotions(self, brand_discounts: [{}]) -> Optional[List[Discounts]]:
         """
@@ -182,7 +419,7 @@ class FaireClient:
                     includes_free_shipping=discount.get("includes_free_shipping"),
                     discount_amount=Cost(
                         amount_minor=discount["discount_amount"]["amount_minor"],
-                        currency=discount["discount_amount"]["amount_minor"],
+                        currency=discount["discount_amount"]["currency"],
                     ),
                     discount_percentage=discount.get("discount_percentage"),
                 )
@@ -217,9 +454,9 @@ class FaireClient:
                     tester_price=item.get("tester_price"),
                     created_at=item["created_at"],
                     updated_at=item["updated_at"],
-                    discounts=item["discounts"],
+                    discounts=self.parse_promotions(item.get("discounts")),
                 )
-            item_list.append(new_item)
+                item_list.append(new_item)
         return item_list
 
     def parse_order_shipments(self, shipments: [{}]) -> List[Shipment]:
@@ -253,12 +490,12 @@ class FaireClient:
         else:
             new_address = Address(
                 address_id=address["id"],
-                address_name=address["name"],
+                name=address["name"],
                 address1=address["address1"],
                 address2=address.get("address2"),
                 postal_code=address["postal_code"],
                 city=address["city"],
-                address_state=address.get("state"),
+                state=address.get("state"),
                 state_code=address.get("state_code"),
                 phone_number=address["phone_number"],
                 country=address["country"],
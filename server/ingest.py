@@ -0,0 +1,317 @@
+"""
+Hot path ingest of raw Faire orders.
+
+Maps raw order dictionaries straight to the BSON ready document that Order(...).doc()
+would produce, without building the nested odmantic models. The mappers are compiled
+once at import time; full model validation is opt-in per call or sampled with
+ingest_validation_sample_rate. While timing spans are enabled, the sub-mappers are timed
+under ingest.* spans matching parse_order's parse.* breakdown.
+"""
+import logging
+import random
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional, Tuple
+
+from bson import ObjectId
+from dateutil import parser
+
+from faire.server.config import BaseConfig
+from faire.server.content_hash import content_hash
+from faire.server.models.order import Order
+from faire.server.profiling import span, timings
+from faire.server.search import order_search_tokens
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+
+def fast_datetime(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse Faire's ISO 8601 timestamps (2023-02-14T01:05:22.000Z) without dateutil,
+    falling back to dateutil for anything fromisoformat does not accept
+    """
+    if not value:
+        return None
+    if value[-1] == "Z":
+        try:
+            return datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return parser.parse(value)
+
+
+class FieldMapper:
+    __slots__ = ("target", "source", "convert", "default", "default_factory")
+
+    def __init__(
+        self,
+        target: str,
+        source: Optional[str] = None,
+        convert: Optional[Callable[[Any], Any]] = None,
+        default: Any = None,
+        default_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.target = target
+        self.source = source or target
+        self.convert = convert
+        self.default = default
+        self.default_factory = default_factory
+
+
+class ObjectMapper:
+    """Maps a raw dictionary to a document with a fixed list of FieldMappers"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, *fields: FieldMapper):
+        # Flatten to tuples once so the per record loop does no attribute lookups
+        self.fields: Tuple[tuple, ...] = tuple(
+            (field.target, field.source, field.convert, field.default, field.default_factory)
+            for field in fields
+        )
+
+    def __call__(self, raw: Optional[dict]) -> Optional[dict]:
+        if not raw:
+            return None
+        document = {}
+        get = raw.get
+        for target, source, convert, default, default_factory in self.fields:
+            value = get(source)
+            if value is None:
+                document[target] = default_factory() if default_factory else default
+            elif convert is None:
+                document[target] = value
+            else:
+                document[target] = convert(value)
+        return document
+
+
+def timed(name: str, convert: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Wrap a field converter in a timing span"""
+
+    def timed_convert(value):
+        with span(name):
+            return convert(value)
+
+    return timed_convert
+
+
+def list_of(mapper: Callable[[dict], dict]) -> Callable[[list], list]:
+    def map_list(values: list) -> list:
+        return [mapper(value) for value in values]
+
+    return map_list
+
+
+def optional_list_of(mapper: Callable[[dict], dict]) -> Callable[[list], Optional[list]]:
+    """Like list_of, but an empty list maps to None the way parse_promotions does"""
+
+    def map_list(values: list) -> Optional[list]:
+        return [mapper(value) for value in values] or None
+
+    return map_list
+
+
+map_cost = ObjectMapper(FieldMapper("amount_minor"), FieldMapper("currency"))
+
+map_customer = ObjectMapper(FieldMapper("first_name"), FieldMapper("last_name"))
+
+map_address = ObjectMapper(
+    FieldMapper("address_id", "id"),
+    FieldMapper("name"),
+    FieldMapper("address1"),
+    FieldMapper("address2"),
+    FieldMapper("postal_code"),
+    FieldMapper("city"),
+    FieldMapper("state"),
+    FieldMapper("state_code"),
+    FieldMapper("phone_number"),
+    FieldMapper("country"),
+    FieldMapper("country_code"),
+    FieldMapper("company_name"),
+)
+
+map_tax = ObjectMapper(
+    FieldMapper("value", convert=map_cost),
+    FieldMapper("taxable_item_type"),
+    FieldMapper("tax_type"),
+    FieldMapper("effect"),
+)
+
+map_payout_costs = ObjectMapper(
+    FieldMapper("payout_fee_bps"),
+    FieldMapper("commission_bps"),
+    FieldMapper("payout_fee", convert=map_cost),
+    FieldMapper("commission", convert=map_cost),
+    FieldMapper("total_payout", convert=map_cost),
+    FieldMapper("payout_protection_fee", convert=map_cost),
+    FieldMapper("damaged_and_missing_items", convert=map_cost),
+    FieldMapper("net_tax", convert=map_cost),
+    FieldMapper("shipping_subsidy", convert=map_cost),
+    FieldMapper("taxes", convert=list_of(map_tax), default_factory=list),
+)
+
+map_discount = ObjectMapper(
+    FieldMapper("discount_id", "id"),
+    FieldMapper("code"),
+    FieldMapper("discount_type"),
+    FieldMapper("includes_free_shipping", default=False),
+    FieldMapper("discount_amount", convert=map_cost),
+    FieldMapper("discount_percentage"),
+)
+
+
+map_order_item = ObjectMapper(
+    FieldMapper("order_item_id", "id"),
+    FieldMapper("order_id"),
+    FieldMapper("state"),
+    FieldMapper("product_id"),
+    FieldMapper("variant_id"),
+    FieldMapper("quantity"),
+    FieldMapper("price", convert=map_cost),
+    FieldMapper("product_name"),
+    FieldMapper("variant_name"),
+    FieldMapper("includes_tester", default=False),
+    FieldMapper("tester_price", convert=map_cost),
+    FieldMapper("created_at", convert=fast_datetime),
+    FieldMapper("updated_at", convert=fast_datetime),
+    FieldMapper("discounts", convert=optional_list_of(map_discount)),
+)
+
+
+map_shipment = ObjectMapper(
+    FieldMapper("shipment_id", "id"),
+    FieldMapper("order_id"),
+    FieldMapper("maker_cost_cents"),
+    FieldMapper("carrier"),
+    FieldMapper("tracking_code"),
+    FieldMapper("created_at", convert=fast_datetime),
+    FieldMapper("updated_at", convert=fast_datetime),
+)
+
+
+def ingest_order_shipments(raw_order: dict) -> List[dict]:
+    """
+    Map the shipments of a raw Faire order to BSON ready Shipment documents
+    """
+    with span("ingest.shipments"):
+        return [map_shipment(shipment) for shipment in raw_order.get("shipments") or []]
+
+
+def ingest_order_items(raw_order: dict) -> List[dict]:
+    """
+    Map the items of a raw Faire order to BSON ready OrderItem documents
+    """
+    documents = []
+    with span("ingest.items"):
+        for raw_item in raw_order.get("items") or []:
+            document = map_order_item(raw_item)
+            # Faire order items have no sku field; like parse_order_items, the unique
+            # sku is the item id
+            document["sku"] = raw_item["id"]
+            documents.append(document)
+    return documents
+
+
+def _ids(values: list) -> list:
+    return [value["id"] for value in values]
+
+
+ORDER_FIELDS = (
+    FieldMapper("provider_order_id", "id"),
+    FieldMapper("display_id"),
+    FieldMapper("created_at", convert=fast_datetime),
+    FieldMapper("updated_at", convert=fast_datetime),
+    FieldMapper("state"),
+    FieldMapper("address", convert=map_address),
+    FieldMapper("ship_after", convert=fast_datetime),
+    FieldMapper("payout_costs", convert=map_payout_costs),
+    FieldMapper("payment_initiated_at", convert=fast_datetime),
+    FieldMapper("original_order_id"),
+    FieldMapper("retailer_id"),
+    FieldMapper("source"),
+    FieldMapper("expected_ship_date", convert=fast_datetime),
+    FieldMapper("customer", convert=map_customer),
+    FieldMapper("processing_at", convert=fast_datetime),
+    FieldMapper("order_item_ids", "items", convert=_ids, default_factory=list),
+    FieldMapper("shipment_ids", "shipments", convert=_ids, default_factory=list),
+    FieldMapper("brand_discounts", convert=list_of(map_discount), default_factory=list),
+)
+# Span of each order field's sub-mapper in the timed mapper
+ORDER_FIELD_SPANS = {
+    "address": "ingest.address",
+    "payout_costs": "ingest.payout",
+    "customer": "ingest.customer",
+    "brand_discounts": "ingest.promotions",
+}
+
+
+def _timed_field(field: FieldMapper) -> FieldMapper:
+    name = ORDER_FIELD_SPANS.get(field.target)
+    if name is None and field.convert is fast_datetime:
+        name = "ingest.dates"
+    if name is None:
+        return field
+    return FieldMapper(
+        field.target,
+        field.source,
+        convert=timed(name, field.convert),
+        default=field.default,
+        default_factory=field.default_factory,
+    )
+
+
+map_order = ObjectMapper(*ORDER_FIELDS)
+# Used while timing spans are enabled, so the untimed mapper pays nothing for them
+map_order_timed = ObjectMapper(*(_timed_field(field) for field in ORDER_FIELDS))
+
+
+def validate_order_document(document: dict) -> Order:
+    """
+    Run full odmantic validation on a mapped document
+    raises: pydantic ValidationError when the document does not fit the Order model
+    """
+    # Mapped documents get their _id from Mongo on insert, parse_doc requires one
+    if "_id" not in document:
+        document = dict(document, _id=ObjectId())
+    return Order.parse_doc(document)
+
+
+def ingest_order(
+    raw_order: dict,
+    order_hash: Optional[int] = None,
+    brand: Optional[str] = None,
+    validate: bool = False,
+    sample_rate: float = config.ingest_validation_sample_rate,
+) -> dict:
+    """
+    Map a raw Faire order to a BSON ready Order document
+    parameter: raw order dictionary, its content hash if already computed, brand it
+        belongs to, validate to always run full model validation, sample_rate to
+        validate a fraction
+    returns: order document ready for upsert_order_documents
+    """
+    document = (map_order_timed if timings.enabled else map_order)(raw_order)
+    document["brand"] = brand
+    document["content_hash"] = (
+        order_hash if order_hash is not None else content_hash(raw_order)
+    )
+    with span("ingest.search_tokens"):
+        document["search_tokens"] = order_search_tokens(raw_order)
+    if validate:
+        validate_order_document(document)
+    elif sample_rate and random.random() < sample_rate:
+        try:
+            validate_order_document(document)
+        except Exception as e:
+            # A sampled failure means the mappers drifted from the Order model
+            logger.error(f"order {document['provider_order_id']} failed validation: {e}")
+    return document
+
+
+def ingest_orders(
+    raw_orders: List[dict], brand: Optional[str] = None, validate: bool = False
+) -> List[dict]:
+    return [
+        ingest_order(raw_order, brand=brand, validate=validate) for raw_order in raw_orders
+    ]
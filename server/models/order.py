@@ -84,7 +84,11 @@ class OrderItem(Model):
     tester_price: Optional[Cost] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
-    discounts: Optional[Discounts] = None
+    discounts: Optional[List[Discounts]] = None
+    # Sales index bookkeeping, see product_sales.upsert_order_items
+    sales_version: Optional[int] = None
+    sales_applied: Optional[dict] = None
+    sales_pending: Optional[dict] = None
 
 
 class Order(Model):
@@ -95,7 +99,7 @@ class Order(Model):
     state: OrderState = Field(default=OrderState.NEW)
     address: Address
     ship_after: datetime = Field(default=None)
-    payout_costs: Cost = Field(default=None)
+    payout_costs: Optional[PayoutCosts] = None
     payment_initiated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
     original_order_id: Optional[str] = None
     retailer_id: str
@@ -108,6 +112,12 @@ class Order(Model):
     # Reference shipment_id
     shipment_ids: Optional[List[str]] = Field(default=None)
     brand_discounts: Optional[List[Discounts]] = None
+    # Brand the order was synced for, API reads are scoped to the caller's brand
+    brand: Optional[str] = None
+    # 64 bit hash of the raw Faire order, used to skip unchanged orders on sync
+    content_hash: Optional[int] = None
+    # Normalized customer, address and product tokens for /orders/search
+    search_tokens: Optional[List[str]] = None
 
     class Index:
         provider_order_id = Index(unique=True)
\ No newline at end of file
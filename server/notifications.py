@@ -0,0 +1,321 @@
+"""
+Batched Slack digests of order events.
+
+Sync only calls notify(), which appends to an in-memory buffer and never waits on Slack.
+A background task drains the buffer every digest window and sends one chat.postMessage
+per channel listing the new, backordered and canceled orders of that window, retrying
+rate limits and server errors with backoff. When the buffer is full, further events are
+only counted and show up as a summary line in the next digest, so a large sync turns
+into a handful of messages instead of one call per order.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from faire.server.config import BaseConfig
+from faire.server.database import engine
+from faire.server.ingest import fast_datetime
+from faire.server.models.enums import OrderState
+from faire.server.models.order import Order
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+NEW_ORDER = "new"
+BACKORDERED = "backordered"
+CANCELED = "canceled"
+EVENT_TITLES = {
+    NEW_ORDER: "new orders",
+    BACKORDERED: "backordered orders",
+    CANCELED: "canceled orders",
+}
+# Upper bound on a single Retry-After wait, so one digest cannot hold up the rest
+MAX_RETRY_WAIT_SECONDS = 60
+
+
+class OrderEvent:
+    __slots__ = ("kind", "order_id", "display_id", "retailer_id")
+
+    def __init__(self, kind: str, order_id: str, display_id: str, retailer_id: str):
+        self.kind = kind
+        self.order_id = order_id
+        self.display_id = display_id
+        self.retailer_id = retailer_id
+
+
+def order_events(
+    raw_orders: Iterable[dict],
+    previous_states: Dict[str, str],
+    new_order_max_age: Optional[timedelta] = None,
+) -> List[OrderEvent]:
+    """
+    Events for orders that are new, or just moved to BACKORDERED or CANCELED
+    parameter: raw orders that were written, their stored state before the write,
+               age after which an unseen order is not reported at all (backfills,
+               imports and first syncs of historical orders)
+    returns: list of OrderEvent
+    """
+    now = datetime.now(timezone.utc)
+    events = []
+    for order in raw_orders:
+        state = order.get("state")
+        previous = previous_states.get(order["id"])
+        if state == previous:
+            continue
+        if previous is None and new_order_max_age:
+            created_at = fast_datetime(order.get("created_at"))
+            if created_at:
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                if now - created_at > new_order_max_age:
+                    continue
+        if state == OrderState.CANCELED.value:
+            kind = CANCELED
+        elif state == OrderState.BACKORDERED.value:
+            kind = BACKORDERED
+        elif previous is None:
+            kind = NEW_ORDER
+        else:
+            continue
+        events.append(
+            OrderEvent(kind, order["id"], order.get("display_id"), order.get("retailer_id"))
+        )
+    return events
+
+
+async def previous_order_states(order_ids: List[str]) -> Dict[str, str]:
+    """
+    Stored state of each order, read before a write so transitions can be detected
+    returns: provider_order_id -> state, orders not stored yet are missing
+    """
+    if not order_ids:
+        return {}
+    cursor = engine.get_collection(Order).find(
+        {"provider_order_id": {"$in": order_ids}}, {"provider_order_id": 1, "state": 1}
+    )
+    return {
+        document["provider_order_id"]: document.get("state") async for document in cursor
+    }
+
+
+def digest_text(events: List[OrderEvent], dropped: Dict[str, int], max_lines: int) -> str:
+    """
+    One message for a channel's events of a window, listing at most max_lines orders
+    per kind and summarizing the rest
+    """
+    by_kind: Dict[str, List[OrderEvent]] = defaultdict(list)
+    for event in events:
+        by_kind[event.kind].append(event)
+    sections = []
+    for kind, title in EVENT_TITLES.items():
+        kind_events = by_kind.get(kind, [])
+        total = len(kind_events) + dropped.get(kind, 0)
+        if not total:
+            continue
+        lines = [f"*{total} {title}*"]
+        for event in kind_events[:max_lines]:
+            retailer = f" (retailer {event.retailer_id})" if event.retailer_id else ""
+            lines.append(f"• {event.display_id or event.order_id}{retailer}")
+        listed = min(len(kind_events), max_lines)
+        if total > listed:
+            lines.append(f"… and {total - listed} more")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+class SlackNotifier:
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str,
+        channels: Dict[str, str],
+        digest_seconds: float,
+        buffer_size: int,
+        max_lines: int,
+        max_retries: int,
+        new_order_max_age: Optional[timedelta] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.api_url = api_url.rstrip("/")
+        # event kind -> channel, kinds without a channel are not sent
+        self.channels = {kind: channel for kind, channel in channels.items() if channel}
+        self.digest_seconds = digest_seconds
+        self.buffer_size = buffer_size
+        self.max_lines = max_lines
+        self.max_retries = max_retries
+        self.new_order_max_age = new_order_max_age
+        # Tests and benchmarks pass an httpx.MockTransport instead of a live Slack
+        self.transport = transport
+        self.buffer: List[OrderEvent] = []
+        self.dropped: Dict[str, int] = defaultdict(int)
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_key and self.channels)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    async def previous_states(self, order_ids: List[str]) -> Dict[str, str]:
+        """Stored states of orders about to be written, skipped when not running"""
+        if not self.running:
+            return {}
+        return await previous_order_states(order_ids)
+
+    def notify_orders(self, raw_orders: Iterable[dict], previous_states: Dict[str, str]):
+        """Buffer events for raw orders that were just written"""
+        if self.running:
+            self.notify(order_events(raw_orders, previous_states, self.new_order_max_age))
+
+    def notify(self, events: Iterable[OrderEvent]):
+        """Buffer events for the next digest, never blocks on Slack"""
+        if not self.running:
+            return
+        for event in events:
+            if event.kind not in self.channels:
+                continue
+            self.queued += 1
+            if len(self.buffer) < self.buffer_size:
+                self.buffer.append(event)
+            else:
+                self.dropped[event.kind] += 1
+        if self.buffer or self.dropped:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None and self.enabled:
+            self.http_client = httpx.AsyncClient(
+                base_url=self.api_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=10,
+                transport=self.transport,
+            )
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker after sending whatever is still buffered"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"final slack digest flush failed: {e}")
+        finally:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            # Let the rest of the window's events arrive before sending
+            await asyncio.sleep(self.digest_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"slack digest flush failed: {e}")
+
+    async def flush(self):
+        self.wakeup.clear()
+        events, self.buffer = self.buffer, []
+        dropped, self.dropped = self.dropped, defaultdict(int)
+        by_channel: Dict[str, List[OrderEvent]] = defaultdict(list)
+        dropped_by_channel: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for event in events:
+            by_channel[self.channels[event.kind]].append(event)
+        for kind, count in dropped.items():
+            dropped_by_channel[self.channels[kind]][kind] = count
+        channels = set(by_channel) | set(dropped_by_channel)
+        await asyncio.gather(
+            *(
+                self._send(
+                    channel,
+                    digest_text(
+                        by_channel.get(channel, []),
+                        dropped_by_channel.get(channel, {}),
+                        self.max_lines,
+                    ),
+                )
+                for channel in channels
+            )
+        )
+
+    async def _send(self, channel: str, text: str) -> bool:
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.http_client.post(
+                    "/chat.postMessage", json={"channel": channel, "text": text}
+                )
+                if response.status_code == 429:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                elif response.status_code < 500:
+                    response.raise_for_status()
+                    body = response.json()
+                    if body.get("ok"):
+                        self.sent += 1
+                        return True
+                    if body.get("error") != "ratelimited":
+                        logger.error(f"slack digest to {channel} rejected: {body}")
+                        break
+            except httpx.HTTPStatusError as e:
+                logger.error(f"slack digest to {channel} rejected: {e}")
+                break
+            except ValueError as e:
+                # A 2xx that is not Slack's JSON, e.g. a proxy page or a bad stand-in
+                logger.error(f"slack digest to {channel} got an invalid response: {e}")
+                break
+            except httpx.TransportError as e:
+                logger.warning(f"slack digest to {channel} failed: {e}")
+            if attempt < self.max_retries:
+                self.retried += 1
+                wait = retry_after if retry_after is not None else 2 ** attempt
+                await asyncio.sleep(min(wait, MAX_RETRY_WAIT_SECONDS))
+        self.failed += 1
+        return False
+
+    def dict(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "buffered": len(self.buffer),
+            "dropped": sum(self.dropped.values()),
+            "queued": self.queued,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+order_notifier = SlackNotifier(
+    api_key=config.slack_api_key,
+    api_url=config.slack_api_url,
+    channels={
+        NEW_ORDER: config.slack_orders_channel,
+        BACKORDERED: config.slack_backorders_channel or config.slack_orders_channel,
+        CANCELED: config.slack_cancellations_channel or config.slack_orders_channel,
+    },
+    digest_seconds=config.slack_digest_seconds,
+    buffer_size=config.slack_buffer_size,
+    max_lines=config.slack_digest_max_lines,
+    max_retries=config.slack_max_retries,
+    new_order_max_age=timedelta(hours=config.slack_new_order_max_age_hours),
+)
@@ -0,0 +1,405 @@
+"""
+Bulk import of order dumps in Faire's /orders JSON format.
+
+The upload is spooled to a temporary file while the request is open, then imported by
+a background task so the caller gets the job id at once and can poll its progress. The
+file is read in fixed size chunks and fed through an incremental parser that yields
+one raw order dictionary at a time. Memory therefore stays bounded by the chunk size
+plus the largest single order, whatever the size of the dump. Orders older than the
+copy already stored (an old dump replayed over newer synced data) are skipped and
+reported on the job. Job progress is also saved to Mongo after every batch, so any
+worker can answer a progress poll.
+"""
+import asyncio
+import codecs
+import json
+import logging
+import os
+import tempfile
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+from faire.server.database import engine
+from faire.server.faire_client import FaireClient
+from faire.server.ingest import ingest_order
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 1024 * 1024
+IMPORT_BATCH_SIZE = 500
+# Largest single JSON value we are willing to buffer while waiting for it to complete
+MAX_VALUE_SIZE = 16 * 1024 * 1024
+# Keep only the first few parse errors on the job, the counters carry the rest
+MAX_JOB_ERRORS = 20
+# Jobs kept for progress polling; the oldest finished jobs are dropped past this
+MAX_IMPORT_JOBS = 100
+MAX_RUNNING_IMPORTS = 4
+IMPORT_JOBS_COLLECTION = "import_jobs"
+# Saved jobs are removed this long after they start
+IMPORT_JOB_TTL_SECONDS = 7 * 24 * 60 * 60
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportJob:
+    def __init__(self, filename: Optional[str] = None):
+        self.job_id = str(uuid.uuid4())
+        self.filename = filename
+        self.status = "running"
+        self.bytes_read = 0
+        self.orders_seen = 0
+        self.orders_failed = 0
+        self.orders_written = 0
+        # Orders older than the stored copy, left as they are
+        self.orders_stale = 0
+        self.stale_order_ids: List[str] = []
+        self.errors: List[str] = []
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def add_error(self, message: str):
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append(message)
+
+    def add_stale(self, provider_order_ids: List[str]):
+        self.orders_stale += len(provider_order_ids)
+        room = MAX_JOB_ERRORS - len(self.stale_order_ids)
+        self.stale_order_ids.extend(provider_order_ids[: max(room, 0)])
+
+    def dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "bytes_read": self.bytes_read,
+            "orders_seen": self.orders_seen,
+            "orders_failed": self.orders_failed,
+            "orders_written": self.orders_written,
+            "orders_stale": self.orders_stale,
+            "stale_order_ids": self.stale_order_ids,
+            "errors": self.errors,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ImportJobs:
+    """
+    Bounded in process registry of this worker's jobs, backed by the import_jobs
+    collection so GET /orders/import/{job_id} works on every worker
+    """
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+
+    def add(self, job: ImportJob):
+        self.jobs[job.job_id] = job
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[: max(len(self.jobs) - self.max_jobs, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        return self.jobs.get(job_id)
+
+    @staticmethod
+    def collection():
+        return engine.database[IMPORT_JOBS_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection().create_index(
+            "started_at", expireAfterSeconds=IMPORT_JOB_TTL_SECONDS
+        )
+
+    async def save(self, job: ImportJob):
+        document = job.dict()
+        document["_id"] = job.job_id
+        await self.collection().replace_one({"_id": job.job_id}, document, upsert=True)
+
+    async def find(self, job_id: str) -> Optional[dict]:
+        """
+        returns: progress of a job started on any worker, or None
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.dict()
+        document = await self.collection().find_one({"_id": job_id}, {"_id": 0})
+        return document
+
+    def running(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.finished_at is None)
+
+
+import_jobs = ImportJobs(MAX_IMPORT_JOBS)
+# Background import tasks, referenced so they are not garbage collected mid-run
+_import_tasks: Set[asyncio.Task] = set()
+
+
+class _StreamBuffer:
+    """Text buffer over an async byte chunk source that only keeps unconsumed data"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    async def fill(self) -> bool:
+        if self.exhausted:
+            return False
+        # Drop what has already been consumed before growing the buffer
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.exhausted = True
+            self.text += self._utf8.decode(b"", final=True)
+            return False
+        self.text += self._utf8.decode(chunk)
+        return True
+
+    async def peek(self) -> str:
+        """Skip whitespace and return the next character, or an empty string at EOF"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not await self.fill():
+                return ""
+
+    async def expect(self, character: str):
+        found = await self.peek()
+        if found != character:
+            raise ImportFormatError(f"expected {character!r}, found {found!r}")
+        self.pos += 1
+
+    async def value(self):
+        """Decode the next complete JSON value, reading more chunks until it is whole"""
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if len(self.text) - self.pos > MAX_VALUE_SIZE:
+                    raise ImportFormatError("value exceeds maximum size or is malformed")
+                if not await self.fill():
+                    raise ImportFormatError("unexpected end of upload")
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self.text) and not self.exhausted and await self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+async def _iter_array(buffer: _StreamBuffer) -> AsyncIterator[dict]:
+    await buffer.expect("[")
+    if await buffer.peek() == "]":
+        buffer.pos += 1
+        return
+    while True:
+        yield await buffer.value()
+        separator = await buffer.peek()
+        buffer.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ImportFormatError(f"expected ',' or ']', found {separator!r}")
+
+
+async def iter_raw_orders(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """
+    Incrementally parse an order dump
+    parameter: async iterator of byte chunks holding either a Faire /orders page
+        ({"page": 1, "orders": [...]}) or a bare list of orders
+    return: async iterator of raw order dictionaries
+    """
+    buffer = _StreamBuffer(chunks)
+    start = await buffer.peek()
+    if start == "[":
+        async for order in _iter_array(buffer):
+            yield order
+        return
+    if start != "{":
+        raise ImportFormatError("upload must be a JSON object or list of orders")
+
+    buffer.pos += 1
+    while await buffer.peek() != "}":
+        key = await buffer.value()
+        await buffer.expect(":")
+        if key == "orders":
+            async for order in _iter_array(buffer):
+                yield order
+        else:
+            # page, limit and other scalar page metadata
+            await buffer.value()
+        if await buffer.peek() == ",":
+            buffer.pos += 1
+
+
+async def _read_chunks(upload, job: ImportJob, chunk_size: int) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        job.bytes_read += len(chunk)
+        yield chunk
+
+
+def _ingest_batch(batch: List[dict], brand: str) -> Tuple[List[dict], List[str]]:
+    """
+    Map and validate a batch of raw orders
+    returns: (order documents, errors of the orders that did not validate)
+    """
+    documents = []
+    errors = []
+    for raw_order in batch:
+        try:
+            documents.append(ingest_order(raw_order, brand=brand, validate=True))
+        except Exception as e:
+            errors.append(f"order {raw_order.get('id')}: {e}")
+    return documents, errors
+
+
+async def _write_batch(faire_client: FaireClient, batch: List[dict], job: ImportJob):
+    # Validating a batch takes long enough to stall every request on this worker,
+    # so it runs in the default executor
+    documents, errors = await asyncio.get_running_loop().run_in_executor(
+        None, _ingest_batch, batch, faire_client.brand
+    )
+    job.orders_failed += len(errors)
+    for error in errors:
+        job.add_error(error)
+    if documents:
+        written, stale = await faire_client.save_newer_order_documents(batch, documents)
+        job.orders_written += written
+        job.add_stale(stale)
+
+
+async def run_import(
+    upload,
+    faire_client: FaireClient,
+    job: ImportJob,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportJob:
+    """
+    Stream an uploaded order dump into Mongo in validated, bulk upserted batches
+    parameter: UploadFile (or anything with an async read(size)), FaireClient used for
+        parsing, job to report progress on
+    returns: the finished job
+    """
+    import_jobs.add(job)
+    await import_jobs.save(job)
+    batch = []
+    try:
+        async for raw_order in iter_raw_orders(_read_chunks(upload, job, chunk_size)):
+            job.orders_seen += 1
+            if not isinstance(raw_order, dict):
+                job.orders_failed += 1
+                job.add_error(f"order #{job.orders_seen} is not an object")
+                continue
+            batch.append(raw_order)
+            if len(batch) >= batch_size:
+                await _write_batch(faire_client, batch, job)
+                await import_jobs.save(job)
+                batch = []
+        if batch:
+            await _write_batch(faire_client, batch, job)
+        job.status = "completed"
+    except ImportFormatError as e:
+        job.status = "failed"
+        job.add_error(f"malformed upload after {job.bytes_read} bytes: {e}")
+    except asyncio.CancelledError:
+        job.status = "failed"
+        job.add_error(f"interrupted after {job.bytes_read} bytes, e.g. by a shutdown")
+        raise
+    except Exception as e:
+        logger.exception(f"order import {job.job_id} failed")
+        job.status = "failed"
+        job.add_error(str(e))
+    finally:
+        job.finished_at = datetime.utcnow()
+        try:
+            await import_jobs.save(job)
+        except Exception as e:
+            logger.error(f"could not save import job {job.job_id}: {e}")
+    return job
+
+
+class _SpooledUpload:
+    """Async read(size) over a spooled upload file, reading off the event loop"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+
+    async def read(self, size: int) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(None, self.file.read, size)
+
+    def close(self):
+        self.file.close()
+
+
+async def spool_upload(upload, chunk_size: int = IMPORT_CHUNK_SIZE) -> str:
+    """
+    Copy an upload to a temporary file so it outlives the request
+    parameter: UploadFile (or anything with an async read(size))
+    returns: path of the temporary file, removed by the import that reads it
+    """
+    loop = asyncio.get_running_loop()
+    spool = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            await loop.run_in_executor(None, spool.write, chunk)
+    except Exception:
+        spool.close()
+        os.remove(spool.name)
+        raise
+    spool.close()
+    return spool.name
+
+
+async def _import_spooled(path: str, faire_client: FaireClient, job: ImportJob):
+    upload = _SpooledUpload(path)
+    try:
+        await run_import(upload, faire_client, job)
+    finally:
+        upload.close()
+        os.remove(path)
+
+
+def start_import(path: str, faire_client: FaireClient, job: ImportJob) -> asyncio.Task:
+    """
+    Import a spooled upload in the background
+    parameter: path from spool_upload, FaireClient used for parsing, job to report on
+    returns: the running task; progress is on the job in import_jobs
+    """
+    import_jobs.add(job)
+    task = asyncio.create_task(_import_spooled(path, faire_client, job))
+    _import_tasks.add(task)
+    task.add_done_callback(_import_tasks.discard)
+    return task
+
+
+async def stop_imports():
+    """
+    Cancel this worker's background imports, at shutdown before the Mongo pool closes.
+    Each job is saved as failed and its spooled file removed.
+    """
+    tasks = list(_import_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,97 @@
+from typing import List, Optional
+
+from faire.server.database import engine
+from faire.server.models.enums import OrderState
+from faire.server.models.order import Order
+from faire.server.serialization import DocumentSerializer, order_serializer
+
+# Newest orders first, _id breaks ties between orders created in the same millisecond
+ORDER_SORT = [("created_at", -1), ("_id", -1)]
+
+
+def order_filter(
+    state: Optional[OrderState] = None, brand: Optional[str] = None
+) -> dict:
+    query = {}
+    if state:
+        query["state"] = state.value
+    if brand:
+        query["brand"] = brand
+    return query
+
+
+async def ensure_read_indexes():
+    # One per filter order_filter can build, each ending in the ORDER_SORT keys so a
+    # page (and its version) is read in index order instead of sorting the collection
+    collection = engine.get_collection(Order)
+    sort_keys = list(ORDER_SORT)
+    await collection.create_index(sort_keys)
+    await collection.create_index([("brand", 1)] + sort_keys)
+    await collection.create_index([("state", 1)] + sort_keys)
+    await collection.create_index([("brand", 1), ("state", 1)] + sort_keys)
+
+
+async def order_page_version(query: dict, skip: int, limit: int) -> List[list]:
+    """
+    Identity of a page of orders, without loading the documents
+    parameter: mongo filter, number of orders to skip, page size
+    returns: [_id, content_hash, updated_at] of each order on the page, in page order
+    """
+    pipeline = [
+        {"$match": query},
+        {"$sort": dict(ORDER_SORT)},
+        {"$skip": skip},
+        {"$limit": limit},
+        {
+            "$group": {
+                "_id": None,
+                "orders": {"$push": ["$_id", "$content_hash", "$updated_at"]},
+            }
+        },
+    ]
+    collection = engine.get_collection(Order)
+    async for result in collection.aggregate(pipeline):
+        return result["orders"]
+    return []
+
+
+async def order_version(provider_order_id: str, brand: Optional[str] = None) -> list:
+    """
+    returns: [content_hash, updated_at] of the order, or an empty list when not found
+    """
+    collection = engine.get_collection(Order)
+    document = await collection.find_one(
+        {"provider_order_id": provider_order_id, **order_filter(brand=brand)},
+        projection={"_id": 0, "content_hash": 1, "updated_at": 1},
+    )
+    if not document:
+        return []
+    return [document.get("content_hash"), document["updated_at"]]
+
+
+async def find_orders(
+    query: dict, skip: int, limit: int, serializer: DocumentSerializer = order_serializer
+) -> List[dict]:
+    """
+    Raw order documents for a page, reading only the serializer's fields
+    """
+    collection = engine.get_collection(Order)
+    cursor = (
+        collection.find(query, projection=serializer.projection)
+        .sort(ORDER_SORT)
+        .skip(skip)
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def find_order(
+    provider_order_id: str,
+    brand: Optional[str] = None,
+    serializer: DocumentSerializer = order_serializer,
+) -> Optional[dict]:
+    collection = engine.get_collection(Order)
+    return await collection.find_one(
+        {"provider_order_id": provider_order_id, **order_filter(brand=brand)},
+        projection=serializer.projection,
+    )
@@ -0,0 +1,204 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from pymongo.results import BulkWriteResult
+
+from faire.server.database import engine
+from faire.server.models.order import Order
+from faire.server.response_cache import order_response_cache
+
+# Number of write operations sent to Mongo per bulk_write round trip
+UPSERT_BATCH_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+
+def order_upsert_op(document: dict) -> ReplaceOne:
+    """
+    Build a replace-or-insert operation for a raw order document keyed on provider_order_id
+    parameter: BSON ready order document, with or without an _id
+    returns: ReplaceOne operation
+    """
+    document = dict(document)
+    # Keep the _id of an existing order, let mongo assign one for new orders
+    document.pop("_id", None)
+    return ReplaceOne(
+        {"provider_order_id": document["provider_order_id"]}, document, upsert=True
+    )
+
+
+def newer_order_upsert_op(document: dict) -> ReplaceOne:
+    """
+    Like order_upsert_op, but leaves a stored order alone when its updated_at is newer
+    than the incoming one. The upsert of such an order then fails on the unique
+    provider_order_id index, see bulk_write_conditional.
+    parameter: BSON ready order document
+    returns: ReplaceOne operation
+    """
+    document = dict(document)
+    document.pop("_id", None)
+    return ReplaceOne(
+        {
+            "provider_order_id": document["provider_order_id"],
+            "$or": [
+                {"updated_at": {"$lte": document.get("updated_at")}},
+                {"updated_at": None},
+            ],
+        },
+        document,
+        upsert=True,
+    )
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Mongo hands back naive UTC datetimes, ingest produces aware ones"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def stored_update_times(provider_order_ids: List[str]) -> Dict[str, datetime]:
+    """
+    returns: provider_order_id -> stored updated_at (naive UTC), orders not stored
+        yet or without updated_at are missing
+    """
+    if not provider_order_ids:
+        return {}
+    cursor = engine.get_collection(Order).find(
+        {"provider_order_id": {"$in": provider_order_ids}},
+        {"_id": 0, "provider_order_id": 1, "updated_at": 1},
+    )
+    return {
+        document["provider_order_id"]: document["updated_at"]
+        async for document in cursor
+        if document.get("updated_at") is not None
+    }
+
+
+def split_stale(
+    documents: List[dict], stored: Dict[str, datetime]
+) -> Tuple[List[dict], List[str]]:
+    """
+    Separate order documents older than their stored copy
+    parameter: order documents, stored updated_at per order (see stored_update_times)
+    returns: (documents to write, provider_order_ids of the stale ones)
+    """
+    fresh = []
+    stale = []
+    for document in documents:
+        stored_at = stored.get(document["provider_order_id"])
+        updated_at = naive_utc(document.get("updated_at"))
+        if stored_at is not None and (updated_at is None or updated_at < stored_at):
+            stale.append(document["provider_order_id"])
+        else:
+            fresh.append(document)
+    return fresh, stale
+
+
+async def bulk_write_batched(
+    collection, operations: Iterable, batch_size: int = UPSERT_BATCH_SIZE
+) -> int:
+    """
+    Send write operations to a motor collection in unordered batches
+    parameter: motor collection, iterable of pymongo write operations, batch size
+    returns: number of documents inserted, upserted or modified
+    """
+    written = 0
+    batch = []
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= batch_size:
+            written += _count_writes(await collection.bulk_write(batch, ordered=False))
+            batch = []
+    if batch:
+        written += _count_writes(await collection.bulk_write(batch, ordered=False))
+    return written
+
+
+def _count_writes(result: BulkWriteResult) -> int:
+    return result.inserted_count + result.upserted_count + result.modified_count
+
+
+async def bulk_write_conditional(
+    collection, operations: List, batch_size: int = UPSERT_BATCH_SIZE
+) -> Tuple[int, List[int]]:
+    """
+    Send conditional upserts in unordered batches. An upsert whose filter no longer
+    matches (another writer got there first) fails with a duplicate key error on the
+    collection's unique index; those are collected instead of raised.
+    parameter: motor collection, list of pymongo write operations, batch size
+    returns: (number of documents written, indexes of the operations that failed)
+    """
+    written = 0
+    failed = []
+    for start in range(0, len(operations), batch_size):
+        try:
+            result = await collection.bulk_write(
+                operations[start:start + batch_size], ordered=False
+            )
+            written += _count_writes(result)
+        except BulkWriteError as e:
+            details = e.details
+            errors = details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            written += details["nInserted"] + details["nUpserted"] + details["nModified"]
+            failed.extend(start + error["index"] for error in errors)
+    return written, failed
+
+
+async def ensure_order_indexes():
+    # Every order write is an upsert keyed on provider_order_id; the unique index keeps
+    # those lookups off a collection scan and concurrent upserts of one order from
+    # inserting it twice
+    await engine.get_collection(Order).create_index("provider_order_id", unique=True)
+    # Newest stored update, where the consistency poll resumes after a restart
+    await engine.get_collection(Order).create_index([("updated_at", -1)])
+
+
+async def upsert_order_documents(
+    documents: Iterable[dict], batch_size: int = UPSERT_BATCH_SIZE
+) -> int:
+    """
+    Upsert raw order documents into the order collection in batches
+    parameter: iterable of BSON ready order documents
+    returns: number of orders written
+    """
+    collection = engine.get_collection(Order)
+    written = await bulk_write_batched(
+        collection, (order_upsert_op(document) for document in documents), batch_size
+    )
+    if written:
+        order_response_cache.invalidate()
+    return written
+
+
+async def upsert_newer_order_documents(
+    documents: List[dict], batch_size: int = UPSERT_BATCH_SIZE
+) -> Tuple[int, List[str]]:
+    """
+    Upsert order documents unless the stored copy was updated more recently
+    parameter: list of BSON ready order documents
+    returns: (number of orders written, provider_order_ids skipped as stale)
+    """
+    collection = engine.get_collection(Order)
+    written, failed = await bulk_write_conditional(
+        collection, [newer_order_upsert_op(document) for document in documents], batch_size
+    )
+    if written:
+        order_response_cache.invalidate()
+    return written, [documents[index]["provider_order_id"] for index in failed]
+
+
+async def upsert_orders(
+    orders: List[Order], batch_size: Optional[int] = UPSERT_BATCH_SIZE
+) -> int:
+    """
+    Upsert Order models into the order collection in batches
+    parameter: list of Order models
+    returns: number of orders written
+    """
+    return await upsert_order_documents(
+        (order.doc() for order in orders), batch_size=batch_size
+    )
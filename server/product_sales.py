@@ -0,0 +1,315 @@
+"""
+Persisted order items and an incrementally maintained per-SKU daily sales index.
+
+Each item document records the contribution it has applied to product_sales_daily
+(sales_applied) and a version. A write replaces the item only if the version is still
+the one it read. Concurrent writers of the same order therefore conflict and re-read
+instead of both diffing against the same stored copy. The change in units, gross and
+testers is recorded on the item as sales_pending before it is applied with $inc. Each
+$inc is tagged with an op id so applying it again is a no-op. A write interrupted
+between the two steps is finished by the next writer of that item.
+
+Re-syncing an unchanged or updated order never double counts, and canceled items drop
+out of the totals. Analytics read the small daily rollup instead of scanning orders.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+
+from faire.server.database import engine
+from faire.server.models.enums import OrderState
+from faire.server.models.order import OrderItem
+from faire.server.order_store import UPSERT_BATCH_SIZE, bulk_write_conditional
+
+logger = logging.getLogger(__name__)
+
+SALES_COLLECTION = "product_sales_daily"
+COUNTERS = ("units", "gross_minor", "tester_count", "item_count")
+# Ops recently applied to a rollup document, so a repeated op is recognized
+APPLIED_OPS_WINDOW = 200
+# Rounds of re-reading items that another writer changed concurrently
+WRITE_ATTEMPTS = 5
+
+SalesKey = Tuple[str, Optional[str], datetime]
+
+
+def sales_collection():
+    return engine.database[SALES_COLLECTION]
+
+
+def _day(value: datetime) -> datetime:
+    return datetime.combine(value.date(), time.min)
+
+
+def item_contribution(item: Optional[dict]) -> Optional[dict]:
+    """
+    What a single item document adds to the daily sales index
+    parameter: OrderItem document, or None for an item that did not exist yet
+    returns: product_id, variant_id, day and counters, or None if it adds nothing
+    """
+    if not item or item.get("state") == OrderState.CANCELED.value:
+        return None
+    quantity = item.get("quantity") or 0
+    price = item.get("price") or {}
+    return {
+        "product_id": item["product_id"],
+        "variant_id": item.get("variant_id"),
+        "day": _day(item["created_at"]),
+        "units": quantity,
+        "gross_minor": (price.get("amount_minor") or 0) * quantity,
+        "tester_count": 1 if item.get("includes_tester") else 0,
+        "item_count": 1,
+    }
+
+
+def sales_deltas(
+    applied: Optional[dict], contribution: Optional[dict]
+) -> Dict[SalesKey, dict]:
+    """
+    Rollup changes that turn an applied contribution into a new one
+    parameter: contribution already in the index, contribution it should have now
+    returns: counters to $inc per (product_id, variant_id, day), zero changes omitted
+    """
+    deltas: Dict[SalesKey, dict] = defaultdict(lambda: defaultdict(int))
+    for sign, document in ((-1, applied), (1, contribution)):
+        if document:
+            key = (document["product_id"], document.get("variant_id"), document["day"])
+            for name in COUNTERS:
+                deltas[key][name] += sign * (document.get(name) or 0)
+    return {
+        key: dict(counters)
+        for key, counters in deltas.items()
+        if any(counters.values())
+    }
+
+
+def applied_contribution(stored: Optional[dict]) -> Optional[dict]:
+    if stored is None:
+        return None
+    if "sales_version" not in stored:
+        # Written before contributions were recorded, its fields are what was applied
+        return item_contribution(stored)
+    return stored.get("sales_applied")
+
+
+def item_write(item: dict, stored: Optional[dict]) -> Tuple[ReplaceOne, dict]:
+    """
+    Conditional replace of an item, valid only if the stored version is unchanged
+    parameter: incoming item document, stored copy of it or None
+    returns: (operation, document written)
+    """
+    version = stored.get("sales_version", 0) if stored else 0
+    applied = applied_contribution(stored)
+    contribution = item_contribution(item)
+    document = dict(item, sales_version=version + 1, sales_applied=contribution)
+    document["sales_pending"] = None
+    if sales_deltas(applied, contribution):
+        document["sales_applied"] = applied
+        document["sales_pending"] = {
+            "op": f"{item['order_item_id']}:{version + 1}",
+            "applied": contribution,
+        }
+    # A new item, or one written before versioning, has no sales_version yet. If
+    # another writer inserted it meanwhile, the upsert fails on the unique index
+    version_filter = version if version else {"$exists": False}
+    operation = ReplaceOne(
+        {"order_item_id": item["order_item_id"], "sales_version": version_filter},
+        document,
+        upsert=True,
+    )
+    return operation, document
+
+
+async def complete_sales(items: List[dict], batch_size: int = UPSERT_BATCH_SIZE):
+    """
+    Apply the pending sales change of each item to the rollup, then mark it applied.
+    Safe to repeat: an op already in a rollup document's applied_ops is skipped.
+    parameter: item documents with sales_pending set
+    """
+    rollup_updates = []
+    for item in items:
+        pending = item["sales_pending"]
+        deltas = sales_deltas(item.get("sales_applied"), pending["applied"])
+        for (product_id, variant_id, day), counters in deltas.items():
+            rollup_updates.append(
+                UpdateOne(
+                    {
+                        "product_id": product_id,
+                        "variant_id": variant_id,
+                        "day": day,
+                        "applied_ops": {"$ne": pending["op"]},
+                    },
+                    {
+                        "$inc": counters,
+                        "$push": {
+                            "applied_ops": {
+                                "$each": [pending["op"]],
+                                "$slice": -APPLIED_OPS_WINDOW,
+                            }
+                        },
+                        "$set": {
+                            "product_name": item.get("product_name"),
+                            "currency": (item.get("price") or {}).get("currency"),
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+    # A duplicate key means the op was already applied, or that another writer created
+    # the rollup document first. Once it exists, only the first case can fail again.
+    _, failed = await bulk_write_conditional(sales_collection(), rollup_updates, batch_size)
+    if failed:
+        await bulk_write_conditional(
+            sales_collection(), [rollup_updates[index] for index in failed], batch_size
+        )
+
+    await bulk_write_conditional(
+        engine.get_collection(OrderItem),
+        [
+            UpdateOne(
+                {
+                    "order_item_id": item["order_item_id"],
+                    "sales_pending.op": item["sales_pending"]["op"],
+                },
+                {
+                    "$set": {"sales_applied": item["sales_pending"]["applied"]},
+                    "$unset": {"sales_pending": ""},
+                },
+            )
+            for item in items
+        ],
+        batch_size,
+    )
+
+
+async def upsert_order_items(
+    items: List[dict], batch_size: int = UPSERT_BATCH_SIZE
+) -> int:
+    """
+    Persist OrderItem documents and apply their change to the daily sales index
+    parameter: BSON ready OrderItem documents (see ingest.ingest_order_items)
+    returns: number of items written
+    raises: Exception when items keep conflicting with concurrent writers
+    """
+    if not items:
+        return 0
+    # The same item twice in one batch would be diffed against the same stored copy
+    remaining = {item["order_item_id"]: item for item in items}
+    item_collection = engine.get_collection(OrderItem)
+    written = 0
+    for _ in range(WRITE_ATTEMPTS):
+        stored_items = {
+            document["order_item_id"]: document
+            async for document in item_collection.find(
+                {"order_item_id": {"$in": list(remaining)}}
+            )
+        }
+        # Finish writes that were interrupted before their rollup update, so the
+        # applied contribution is current before it is diffed against
+        interrupted = [item for item in stored_items.values() if item.get("sales_pending")]
+        if interrupted:
+            await complete_sales(interrupted, batch_size)
+            for item in interrupted:
+                item["sales_applied"] = item.pop("sales_pending")["applied"]
+
+        order_item_ids = list(remaining)
+        writes = [
+            item_write(remaining[order_item_id], stored_items.get(order_item_id))
+            for order_item_id in order_item_ids
+        ]
+        count, failed = await bulk_write_conditional(
+            item_collection, [operation for operation, _ in writes], batch_size
+        )
+        written += count
+        failed = set(failed)
+        await complete_sales(
+            [
+                document
+                for index, (_, document) in enumerate(writes)
+                if index not in failed and document["sales_pending"]
+            ],
+            batch_size,
+        )
+        if not failed:
+            return written
+        # Changed by another writer since they were read, diff against the new copy
+        remaining = {
+            order_item_ids[index]: remaining[order_item_ids[index]] for index in failed
+        }
+        logger.info(f"retrying {len(remaining)} concurrently written order items")
+    raise Exception(f"order items kept conflicting with other writers: {list(remaining)}")
+
+
+async def ensure_sales_indexes():
+    await engine.get_collection(OrderItem).create_index("order_item_id", unique=True)
+    await sales_collection().create_index(
+        [("product_id", 1), ("variant_id", 1), ("day", 1)], unique=True
+    )
+    await sales_collection().create_index([("day", 1), ("product_id", 1)])
+
+
+async def top_products(
+    start: datetime, end: datetime, metric: str = "units", limit: int = 10
+) -> List[dict]:
+    """
+    Best selling products between two days (inclusive)
+    parameter: start and end day, metric to rank by (units, gross_minor, tester_count)
+    returns: list of per product totals, best first
+    """
+    pipeline = [
+        {"$match": {"day": {"$gte": _day(start), "$lte": _day(end)}}},
+        {
+            "$group": {
+                "_id": "$product_id",
+                "product_name": {"$last": "$product_name"},
+                "currency": {"$last": "$currency"},
+                "units": {"$sum": "$units"},
+                "gross_minor": {"$sum": "$gross_minor"},
+                "tester_count": {"$sum": "$tester_count"},
+                "item_count": {"$sum": "$item_count"},
+            }
+        },
+        {"$sort": {metric: -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    results = []
+    async for document in sales_collection().aggregate(pipeline):
+        document["product_id"] = document.pop("_id")
+        results.append(document)
+    return results
+
+
+async def product_timeseries(
+    product_id: str,
+    start: datetime,
+    end: datetime,
+    variant_id: Optional[str] = None,
+) -> List[dict]:
+    """
+    Daily sales of a product, or one of its variants, between two days (inclusive)
+    returns: list of per day totals, oldest first
+    """
+    match = {"product_id": product_id, "day": {"$gte": _day(start), "$lte": _day(end)}}
+    if variant_id:
+        match["variant_id"] = variant_id
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": "$day",
+                "units": {"$sum": "$units"},
+                "gross_minor": {"$sum": "$gross_minor"},
+                "tester_count": {"$sum": "$tester_count"},
+                "item_count": {"$sum": "$item_count"},
+            }
+        },
+        {"$sort": {"_id": 1}},
+    ]
+    results = []
+    async for document in sales_collection().aggregate(pipeline):
+        document["day"] = document.pop("_id")
+        results.append(document)
+    return results
@@ -0,0 +1,163 @@
+"""
+Timing spans and an on-demand sampling profiler for sync and API hot paths.
+
+Spans are off by default; span() then returns a shared no-op context manager so the
+instrumented code pays one function call and one attribute check. Enable them with
+TIMING_SPANS=true or POST /admin/timings.
+
+The sampling profiler runs in a daemon thread for N seconds, sampling every other
+thread's Python stack, and writes folded stacks ("frame;frame;frame count") that
+flamegraph.pl, speedscope and inferno read directly. Start it with PROFILE_SECONDS=N
+at startup or POST /admin/profile?seconds=N.
+"""
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from faire.server.config import BaseConfig
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+
+class SpanStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Timings:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.stats: Dict[str, SpanStats] = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, elapsed: float):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = SpanStats()
+            stats.count += 1
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def dict(self) -> dict:
+        with self.lock:
+            return {name: stats.dict() for name, stats in sorted(self.stats.items())}
+
+
+timings = Timings(enabled=config.timing_spans)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timings.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def span(name: str):
+    """
+    Time a block under name when timing spans are enabled
+    usage: with span("sync.fetch"): ...
+    """
+    if not timings.enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float, output_dir: str):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.thread: Optional[threading.Thread] = None
+        self.output_path: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds: float) -> Optional[str]:
+        """
+        Sample all threads for the given number of seconds in the background
+        parameter: duration in seconds
+        returns: path the folded stacks will be written to, or None if already running
+        """
+        if self.running:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        # Workers started together profile in the same second, the pid keeps them apart
+        self.output_path = os.path.join(
+            self.output_dir, f"profile-{stamp}-{os.getpid()}.folded"
+        )
+        self.thread = threading.Thread(
+            target=self._run, args=(seconds, self.output_path), daemon=True
+        )
+        self.thread.start()
+        return self.output_path
+
+    def _run(self, seconds: float, output_path: str):
+        own_thread = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        with open(output_path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"profiler wrote {samples} samples to {output_path}")
+
+
+profiler = SamplingProfiler(
+    interval=config.profile_interval_ms / 1000, output_dir=config.profile_dir
+)
@@ -0,0 +1,120 @@
+"""
+Conditional GET support for the order read routes.
+
+Strong ETags hash the query parameters with the _id, content_hash and updated_at of
+every order in the result set, in order. A poll that matches If-None-Match is answered
+with a 304 after a single projected aggregate and no serialization. Because any change
+of membership, order or content changes the ETag, serialized bodies of hot queries can
+be kept in an in-process LRU keyed by ETag without serving stale pages, even when
+another worker wrote the orders. The LRU is also cleared on local writes to free memory.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Request, Response
+
+from faire.server.config import BaseConfig
+
+config = BaseConfig()
+
+
+def _version_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def make_etag(route: str, params: dict, version: Any) -> str:
+    """
+    Build a strong ETag for a result set
+    parameter: route name, query parameters, JSON-able version of the result set
+        (e.g. the ids and content hashes of a page, see order_reads.order_page_version)
+    returns: quoted ETag header value
+    """
+    encoded = json.dumps(
+        [route, params, version], sort_keys=True, default=_version_default
+    )
+    return '"' + hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Strong comparison, weak validators from the client never match
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+class ResponseCache:
+    """LRU of serialized response bodies bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, etag: str) -> Optional[bytes]:
+        with self.lock:
+            body = self.entries.get(etag)
+            if body is not None:
+                self.entries.move_to_end(etag)
+            return body
+
+    def put(self, etag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(etag, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[etag] = body
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+order_response_cache = ResponseCache(
+    max_entries=config.response_cache_max_entries,
+    max_bytes=config.response_cache_max_bytes,
+)
+
+
+async def conditional_response(
+    request: Request,
+    route: str,
+    params: dict,
+    version: Callable[[], Awaitable[Any]],
+    body: Callable[[], Awaitable[bytes]],
+    cache: ResponseCache = order_response_cache,
+) -> Response:
+    """
+    Answer a read with 304, a cached body or a freshly serialized body
+    parameter: incoming request, route name and query params for the ETag,
+        version coroutine returning what identifies the result set,
+        body coroutine returning the serialized JSON response
+    returns: starlette Response
+    """
+    etag = make_etag(route, params, await version())
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    content = cache.get(etag)
+    if content is None:
+        content = await body()
+        cache.put(etag, content)
+    return Response(content=content, media_type="application/json", headers=headers)
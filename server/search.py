@@ -0,0 +1,209 @@
+"""
+Order search over customer, retailer, address and product fields.
+
+Every order document carries search_tokens, a list of normalized (lower case, accent
+free, alphanumeric) tokens derived from the raw Faire order at ingest. Query terms are
+matched as anchored prefixes against the multikey search_tokens index. At most
+MAX_CANDIDATES matches are taken in index order (exact tokens before longer ones sharing
+the prefix, newest first within a token). Only those are ranked, by the number of exact
+token matches then recency, and paginated with keyset cursors. A short prefix therefore
+never re-sorts every matching order.
+"""
+import base64
+import json
+import re
+import unicodedata
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from faire.server.database import engine
+from faire.server.models.order import Order
+
+MIN_TERM_LENGTH = 2
+MAX_TERMS = 5
+MAX_CANDIDATES = 1000
+# Runs of digit groups such as "(541) 326-7572", searched as one phone token
+PHONE_MIN_DIGITS = 7
+# North American numbers, most Faire retailers, are indexed without the +1
+NANP_DIGITS = 10
+_SPLIT = re.compile(r"[^0-9a-z]+")
+_DIGIT_RUN = re.compile(r"\d[\d\s().+-]*\d")
+_PHONE_PUNCTUATION = re.compile(r"[().+-]")
+
+SEARCH_PROJECTION = {
+    "provider_order_id": 1,
+    "display_id": 1,
+    "state": 1,
+    "customer": 1,
+    "address.name": 1,
+    "address.company_name": 1,
+    "address.city": 1,
+    "address.state_code": 1,
+    "retailer_id": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+
+def normalize(text: Optional[str]) -> List[str]:
+    """
+    Split text into lower case ascii tokens
+    parameter: free text, e.g. "Yaté Sparkling Yerba Mate (24 pack)"
+    returns: list of tokens, e.g. ["yate", "sparkling", "yerba", "mate", "24", "pack"]
+    """
+    if not text:
+        return []
+    ascii_text = (
+        unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    )
+    return [token for token in _SPLIT.split(ascii_text.lower()) if token]
+
+
+def phone_digits(text: Optional[str]) -> str:
+    """
+    Digits of a phone number, dropping a North American country code so that
+    "+1 541 326 7572" and "(541) 326-7572" both give "5413267572"
+    """
+    digits = re.sub(r"\D", "", text or "")
+    if len(digits) == NANP_DIGITS + 1 and digits.startswith("1"):
+        return digits[1:]
+    return digits
+
+
+def order_search_tokens(raw_order: dict) -> List[str]:
+    """
+    Collect the searchable tokens of a raw Faire order
+    parameter: raw order dictionary
+    returns: sorted, de-duplicated list of tokens
+    """
+    customer = raw_order.get("customer") or {}
+    address = raw_order.get("address") or {}
+    texts = [
+        customer.get("first_name"),
+        customer.get("last_name"),
+        address.get("name"),
+        address.get("company_name"),
+        address.get("city"),
+        raw_order.get("display_id"),
+    ]
+    texts.extend(item.get("product_name") for item in raw_order.get("items") or [])
+
+    tokens = set()
+    for text in texts:
+        tokens.update(normalize(text))
+    phone = phone_digits(address.get("phone_number"))
+    if phone:
+        tokens.add(phone)
+    return sorted(tokens)
+
+
+async def ensure_search_indexes():
+    collection = engine.get_collection(Order)
+    await collection.create_index(
+        [("search_tokens", 1), ("updated_at", -1), ("_id", -1)], name="search_tokens"
+    )
+
+
+def encode_cursor(score: int, updated_at: datetime, _id: ObjectId) -> str:
+    raw = json.dumps([score, updated_at.isoformat(), str(_id)])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, datetime, ObjectId]:
+    """
+    raises: ValueError when the cursor was not produced by encode_cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        score, updated_at, _id = json.loads(raw)
+        return int(score), datetime.fromisoformat(updated_at), ObjectId(_id)
+    except Exception:
+        raise ValueError("Invalid search cursor")
+
+
+def _collapse_digit_run(match: re.Match) -> str:
+    run = match.group(0)
+    digits = re.sub(r"\D", "", run)
+    if _PHONE_PUNCTUATION.search(run) or len(digits) >= PHONE_MIN_DIGITS:
+        return f" {phone_digits(digits)} "
+    return run
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    Normalized, de-duplicated query terms. Formatted phone numbers are collapsed into
+    one run of digits, the way order_search_tokens stores them.
+    """
+    terms = []
+    for term in normalize(_DIGIT_RUN.sub(_collapse_digit_run, query or "")):
+        if len(term) >= MIN_TERM_LENGTH and term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+async def search_orders(
+    query: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    brand: Optional[str] = None,
+) -> dict:
+    """
+    Prefix search over order search tokens
+    parameter: free text query, page size, cursor from a previous page, brand scope
+    returns: {"results": [...], "next_cursor": str or None}
+    raises: ValueError for an empty query or an invalid cursor
+    """
+    terms = query_terms(query)
+    if not terms:
+        raise ValueError(f"Query needs a term of at least {MIN_TERM_LENGTH} characters")
+
+    prefixes = [re.compile("^" + re.escape(term)) for term in terms]
+    match = {"search_tokens": {"$all": prefixes}}
+    if brand:
+        match["brand"] = brand
+    pipeline = [
+        {"$match": match},
+        # Taken in search_tokens index order (see hint below), ranking runs on these only
+        {"$limit": MAX_CANDIDATES},
+        {"$project": {**SEARCH_PROJECTION, "search_tokens": 1}},
+        # Exact token matches rank above prefix only matches
+        {
+            "$addFields": {
+                "score": {"$size": {"$setIntersection": ["$search_tokens", terms]}}
+            }
+        },
+        {"$project": {"search_tokens": 0}},
+    ]
+    if cursor:
+        score, updated_at, _id = decode_cursor(cursor)
+        pipeline.append(
+            {
+                "$match": {
+                    "$or": [
+                        {"score": {"$lt": score}},
+                        {"score": score, "updated_at": {"$lt": updated_at}},
+                        {"score": score, "updated_at": updated_at, "_id": {"$lt": _id}},
+                    ]
+                }
+            }
+        )
+    pipeline += [
+        {"$sort": {"score": -1, "updated_at": -1, "_id": -1}},
+        {"$limit": limit + 1},
+    ]
+
+    collection = engine.get_collection(Order)
+    results = [
+        document
+        async for document in collection.aggregate(pipeline, hint="search_tokens")
+    ]
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        next_cursor = encode_cursor(last["score"], last["updated_at"], last["_id"])
+    for document in results:
+        document["id"] = str(document.pop("_id"))
+    return {"results": results, "next_cursor": next_cursor}
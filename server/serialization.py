@@ -0,0 +1,75 @@
+"""
+Fast JSON serialization of Mongo order documents for API responses.
+
+Documents are read with a projection and dumped straight to bytes with orjson instead of
+being parsed into Order models and walked by jsonable_encoder. Each projection gets a
+DocumentSerializer built once, which renames _id to id (the shape the Order model
+produced) and keeps only the projected fields.
+"""
+from typing import Iterable, Optional, Tuple
+
+import orjson
+from bson import Decimal128, ObjectId
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """orjson dump that understands datetime (natively), ObjectId and Decimal128"""
+    return orjson.dumps(content, default=_default)
+
+
+class DocumentSerializer:
+    __slots__ = ("fields", "projection")
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        # _id always comes back from mongo unless excluded
+        self.projection = {field: 1 for field in fields}
+
+    def to_dict(self, document: dict) -> dict:
+        result = {"id": str(document["_id"])} if "_id" in document else {}
+        get = document.get
+        for field in self.fields:
+            result[field] = get(field)
+        return result
+
+    def dumps(self, document: Optional[dict]) -> bytes:
+        if document is None:
+            return b"null"
+        return dumps(self.to_dict(document))
+
+    def dumps_many(self, documents: Iterable[dict]) -> bytes:
+        to_dict = self.to_dict
+        return dumps([to_dict(document) for document in documents])
+
+
+# Public fields of an Order, content_hash and search_tokens are internal
+ORDER_FIELDS = (
+    "provider_order_id",
+    "display_id",
+    "created_at",
+    "updated_at",
+    "state",
+    "address",
+    "ship_after",
+    "payout_costs",
+    "payment_initiated_at",
+    "original_order_id",
+    "retailer_id",
+    "source",
+    "expected_ship_date",
+    "customer",
+    "processing_at",
+    "order_item_ids",
+    "shipment_ids",
+    "brand_discounts",
+)
+
+order_serializer = DocumentSerializer(ORDER_FIELDS)
@@ -0,0 +1,166 @@
+"""
+Persisted shipments and a scheduled tracking refresher.
+
+Shipment documents are upserted whenever their order is written. ShipmentRefresher
+periodically re-fetches only the orders still in transit (PRE_TRANSIT / IN_TRANSIT),
+most urgent first by expected_ship_date then ship_after (orders without an expected
+ship date last), in bounded-concurrency batches, so carrier and tracking codes stay
+fresh without re-syncing every order. Both queries behind that ordering read the
+(state, expected_ship_date, ship_after) index in order.
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+
+from faire.server.database import engine
+from faire.server.models.enums import OrderState
+from faire.server.models.order import Order, Shipment
+from faire.server.order_store import UPSERT_BATCH_SIZE, bulk_write_batched
+
+logger = logging.getLogger(__name__)
+
+IN_TRANSIT_STATES = [OrderState.PRE_TRANSIT.value, OrderState.IN_TRANSIT.value]
+IN_TRANSIT_INDEX = "in_transit_by_state"
+
+
+async def upsert_shipments(
+    shipments: List[dict], batch_size: int = UPSERT_BATCH_SIZE
+) -> int:
+    """
+    Persist Shipment documents keyed on shipment_id
+    parameter: BSON ready Shipment documents (see ingest.ingest_order_shipments)
+    returns: number of shipments written
+    """
+    if not shipments:
+        return 0
+    return await bulk_write_batched(
+        engine.get_collection(Shipment),
+        (
+            ReplaceOne({"shipment_id": shipment["shipment_id"]}, shipment, upsert=True)
+            for shipment in shipments
+        ),
+        batch_size,
+    )
+
+
+async def ensure_shipment_indexes():
+    shipment_collection = engine.get_collection(Shipment)
+    await shipment_collection.create_index("shipment_id", unique=True)
+    await shipment_collection.create_index("order_id")
+    order_collection = engine.get_collection(Order)
+    try:
+        # Replaced by IN_TRANSIT_INDEX, the refresher query could not use it
+        await order_collection.drop_index("in_transit")
+    except OperationFailure:
+        pass
+    await order_collection.create_index(
+        [("state", 1), ("expected_ship_date", 1), ("ship_after", 1)],
+        name=IN_TRANSIT_INDEX,
+    )
+
+
+async def in_transit_order_ids(limit: int) -> List[str]:
+    """
+    Provider ids of in transit orders, most urgent first
+    parameter: maximum number of orders to return
+    returns: list of provider_order_id
+    """
+    collection = engine.get_collection(Order)
+    projection = {"_id": 0, "provider_order_id": 1}
+    dated = (
+        collection.find(
+            {"state": {"$in": IN_TRANSIT_STATES}, "expected_ship_date": {"$ne": None}},
+            projection,
+        )
+        .sort([("expected_ship_date", 1), ("ship_after", 1)])
+        .hint(IN_TRANSIT_INDEX)
+        .limit(limit)
+    )
+    order_ids = [document["provider_order_id"] async for document in dated]
+    if len(order_ids) < limit:
+        undated = (
+            collection.find(
+                {"state": {"$in": IN_TRANSIT_STATES}, "expected_ship_date": None},
+                projection,
+            )
+            .sort("ship_after", 1)
+            .hint(IN_TRANSIT_INDEX)
+            .limit(limit - len(order_ids))
+        )
+        order_ids.extend([document["provider_order_id"] async for document in undated])
+    return order_ids
+
+
+class ShipmentRefresher:
+    def __init__(
+        self,
+        faire_client,
+        interval_seconds: float,
+        batch_size: int,
+        max_orders: int,
+        max_concurrency: int,
+    ):
+        self.faire_client = faire_client
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.max_orders = max_orders
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.failed = 0
+
+    def start(self):
+        if self.task is None and self.interval_seconds > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"shipment refresh failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def refresh(self) -> int:
+        """
+        Re-fetch in transit orders in priority order
+        returns: number of orders refreshed
+        """
+        order_ids = await in_transit_order_ids(self.max_orders)
+        refreshed = 0
+        for start in range(0, len(order_ids), self.batch_size):
+            batch = order_ids[start:start + self.batch_size]
+            results = await asyncio.gather(*(self._refresh_order(o) for o in batch))
+            refreshed += sum(results)
+        logger.info(f"refreshed {refreshed} of {len(order_ids)} in transit orders")
+        return refreshed
+
+    async def _refresh_order(self, order_id: str) -> bool:
+        async with self.semaphore:
+            try:
+                await self.faire_client.get_order(order_id)
+                self.refreshed += 1
+                return True
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"refresh of order {order_id} failed: {e}")
+                return False
+
+    def dict(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,246 @@
+"""
+Push ingestion of Faire order events.
+
+POST /webhooks/faire verifies the HMAC-SHA256 signature of the raw body, drops events
+that were already processed, and only records the order id before acknowledging. A
+background OrderFetchQueue drains the pending ids every coalesce window, so any number
+of events for one order inside the window turn into a single get_order call. Event
+ids are recorded in Mongo only once their order was fetched, so a redelivery after a
+failed fetch is processed again, and a redelivery to another worker is still dropped.
+ConsistencyPoller keeps a slow incremental /orders poll running to catch anything a
+webhook missed.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+
+from pymongo import UpdateOne
+
+from faire.server.config import BaseConfig
+from faire.server.database import engine
+from faire.server.faire_client import FaireClient
+from faire.server.models.order import Order
+from faire.server.parameters import GetOrdersParams
+
+logger = logging.getLogger(__name__)
+config = BaseConfig()
+
+SIGNATURE_HEADER = "X-Faire-Signature"
+WEBHOOK_EVENTS_COLLECTION = "webhook_events"
+
+
+class InvalidWebhook(ValueError):
+    pass
+
+
+def verify_signature(body: bytes, signature: Optional[str], secret: str) -> bool:
+    """
+    Check the hex HMAC-SHA256 of the raw request body, with or without a "sha256=" prefix
+    """
+    if not signature or not secret:
+        return False
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    # As bytes, compare_digest refuses str with non-ASCII characters
+    return hmac.compare_digest(
+        expected.encode("ascii"), signature.strip().lower().encode("utf-8")
+    )
+
+
+def event_order_id(event: dict) -> str:
+    """
+    Find the order id in a webhook event
+    raises: InvalidWebhook when the event does not reference an order
+    """
+    data = event.get("data") or {}
+    order_id = (
+        data.get("order_id")
+        or (data.get("order") or {}).get("id")
+        or event.get("order_id")
+    )
+    if not order_id:
+        raise InvalidWebhook("event does not reference an order")
+    return order_id
+
+
+class SeenEvents:
+    """
+    Expiring set of processed webhook event ids used to drop redeliveries, shared by
+    every worker through Mongo. A TTL index removes ids older than ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def collection():
+        return engine.database[WEBHOOK_EVENTS_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection().create_index(
+            "seen_at", expireAfterSeconds=int(self.ttl_seconds)
+        )
+
+    async def seen(self, event_id: str) -> bool:
+        """
+        returns: True when the event was already processed within the ttl
+        """
+        document = await self.collection().find_one({"_id": event_id}, {"_id": 1})
+        return document is not None
+
+    async def mark(self, event_ids: Iterable[str]):
+        """Record events whose order was fetched"""
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"_id": event_id}, {"$setOnInsert": {"seen_at": now}}, upsert=True)
+            for event_id in event_ids
+        ]
+        if operations:
+            await self.collection().bulk_write(operations, ordered=False)
+
+
+class OrderFetchQueue:
+    def __init__(
+        self,
+        faire_client: FaireClient,
+        coalesce_seconds: float,
+        max_concurrency: int,
+    ):
+        self.faire_client = faire_client
+        self.coalesce_seconds = coalesce_seconds
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # order id -> ids of the events waiting on its fetch
+        self.pending: Dict[str, Set[str]] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.fetched = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def enqueue(self, order_id: str, event_id: Optional[str] = None):
+        event_ids = self.pending.get(order_id)
+        if event_ids is not None:
+            self.coalesced += 1
+        else:
+            event_ids = self.pending[order_id] = set()
+            self.wakeup.set()
+        if event_id:
+            event_ids.add(event_id)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker after fetching whatever is still pending"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        await self.drain()
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            # Let more events for the same orders arrive before fetching
+            await asyncio.sleep(self.coalesce_seconds)
+            await self.drain()
+
+    async def drain(self):
+        self.wakeup.clear()
+        pending, self.pending = self.pending, {}
+        if pending:
+            await asyncio.gather(
+                *(
+                    self._fetch(order_id, event_ids)
+                    for order_id, event_ids in pending.items()
+                )
+            )
+
+    async def _fetch(self, order_id: str, event_ids: Set[str]):
+        async with self.semaphore:
+            try:
+                await self.faire_client.get_order(order_id)
+                self.fetched += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"webhook fetch of order {order_id} failed: {e}")
+                return
+            try:
+                await seen_events.mark(event_ids)
+            except Exception as e:
+                logger.error(f"could not record webhook events for {order_id}: {e}")
+
+    def dict(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "fetched": self.fetched,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
+
+
+class ConsistencyPoller:
+    """Incremental /orders poll on a slow interval, the fallback for missed webhooks"""
+
+    def __init__(self, faire_client: FaireClient, interval_seconds: float):
+        self.faire_client = faire_client
+        self.interval_seconds = interval_seconds
+        self.last_polled_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None and self.interval_seconds > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        if self.last_polled_at is None:
+            # Resume from what is stored rather than every page. Seeded at startup,
+            # before webhooks write newer orders past the gap left by the restart
+            try:
+                self.last_polled_at = await self.newest_stored_update()
+            except Exception as e:
+                logger.error(f"could not read the newest stored order: {e}")
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.poll()
+
+    async def newest_stored_update(self) -> Optional[datetime]:
+        document = await engine.get_collection(Order).find_one(
+            {}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)]
+        )
+        return document["updated_at"] if document else None
+
+    async def poll(self):
+        started_at = datetime.utcnow()
+        params = GetOrdersParams()
+        if self.last_polled_at:
+            # Overlap the previous poll slightly so clock skew cannot drop updates
+            since = self.last_polled_at - timedelta(minutes=5)
+            params.updated_at_min = since.isoformat() + "Z"
+        try:
+            written = await self.faire_client.sync_all_orders(params)
+            self.last_polled_at = started_at
+            logger.info(f"consistency poll wrote {written} orders")
+        except Exception as e:
+            logger.error(f"consistency poll failed: {e}")
+
+
+seen_events = SeenEvents(ttl_seconds=config.webhook_dedupe_ttl_seconds)
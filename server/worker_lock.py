@@ -0,0 +1,27 @@
+import fcntl
+import os
+
+# Held for the life of the process once acquired
+_lock_file = None
+
+
+def acquire_worker_lock(path: str) -> bool:
+    """
+    Non-blocking exclusive lock so exactly one uvicorn worker runs the schedulers
+    parameter: lock file path shared by all workers on the host
+    returns: True if this process holds the lock
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    _lock_file = lock_file
+    return True
+
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from datetime import datetime
+from pathlib import Path
+
+import boto3
+import pytest
+from pymongo import ReplaceOne
+
+from faire.server.archive import (
+    ROLLUP_PREFIX,
+    SNAPSHOT_PREFIX,
+    OrderArchiver,
+    rollup_keys,
+    rollup_upsert_op,
+)
+from faire.server.content_hash import OrderHashIndex
+from faire.server.faire_client import FaireClient
+from faire.server.product_sales import SALES_COLLECTION
+
+moto = pytest.importorskip("moto")
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+BUCKET = "faire-data-archive-test"
+
+
+@pytest.fixture
+def archiver(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        # Small chunks so the orders.json snapshot is uploaded and fetched in parts
+        yield OrderArchiver(
+            bucket=BUCKET,
+            prefix="test/",
+            s3_client=s3,
+            chunk_size=1024,
+            max_concurrency=4,
+        )
+
+
+def test_snapshot_round_trip(archiver, tmp_path):
+    key = archiver.archive_snapshot(str(ORDERS_PATH))
+    assert key == f"test/{SNAPSHOT_PREFIX}/orders.json"
+    path = tmp_path / "orders.json"
+    size = archiver.download(key, str(path))
+    assert path.read_bytes() == ORDERS_PATH.read_bytes()
+    assert size == path.stat().st_size > archiver.chunk_size
+
+
+def test_small_object_round_trip(archiver, tmp_path):
+    page = {"page": 1, "limit": 50, "orders": [{"id": "bo_1"}]}
+    key = archiver.archive_page(page, "page-1.json")
+    path = tmp_path / "page-1.json"
+    archiver.download(key, str(path))
+    assert json.loads(path.read_text()) == page
+
+
+def test_restore_streams_snapshots_through_fast_ingest(archiver, monkeypatch):
+    pages = []
+
+    async def reload(self):
+        pass
+
+    async def save_orders_page(self, orders_json):
+        assert self.brand == "yate"
+        pages.append(orders_json["orders"])
+        return len(orders_json["orders"])
+
+    monkeypatch.setattr(OrderHashIndex, "reload", reload)
+    monkeypatch.setattr(FaireClient, "save_orders_page", save_orders_page)
+    archiver.archive_snapshot(str(ORDERS_PATH), "page-1.json")
+    archiver.archive_page({"page": 2, "orders": [{"id": "bo_extra"}]}, "page-2.json")
+
+    written = asyncio.run(archiver.restore_snapshots("yate", batch_size=3))
+    orders = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"] + [{"id": "bo_extra"}]
+    assert written == len(orders)
+    assert [order for page in pages for order in page] == orders
+    assert [len(page) for page in pages] == [3, 2]
+
+
+def test_list_keys_by_kind(archiver):
+    archiver.archive_page({"orders": []}, "page-2.json")
+    archiver.archive_page({"orders": []}, "page-1.json")
+    archiver.s3.put_object(
+        Bucket=BUCKET, Key=f"test/{ROLLUP_PREFIX}/{SALES_COLLECTION}.jsonl", Body=b""
+    )
+    assert archiver.list_keys(SNAPSHOT_PREFIX) == [
+        f"test/{SNAPSHOT_PREFIX}/page-1.json",
+        f"test/{SNAPSHOT_PREFIX}/page-2.json",
+    ]
+    assert archiver.list_keys(ROLLUP_PREFIX) == [
+        f"test/{ROLLUP_PREFIX}/{SALES_COLLECTION}.jsonl"
+    ]
+
+
+def test_rollup_restore_matches_natural_key():
+    keys = rollup_keys()[SALES_COLLECTION]
+    day = datetime(2023, 2, 14)
+    document = {
+        "_id": "archived-id",
+        "product_id": "p_1",
+        "variant_id": None,
+        "day": day,
+        "units": 4,
+    }
+    expected = {"product_id": "p_1", "variant_id": None, "day": day, "units": 4}
+    assert rollup_upsert_op(document, keys) == ReplaceOne(
+        {"product_id": "p_1", "variant_id": None, "day": day}, expected, upsert=True
+    )
+    # The archived document itself is left untouched
+    assert document["_id"] == "archived-id"
+
+
+def test_rollup_restore_without_natural_key_matches_id():
+    document = {"_id": "archived-id", "value": 1}
+    assert rollup_upsert_op(document, ()) == ReplaceOne(
+        {"_id": "archived-id"}, document, upsert=True
+    )
+
+
+def test_rollup_keys_cover_restored_collections():
+    assert set(rollup_keys().values()) >= {
+        ("provider_order_id",),
+        ("order_item_id",),
+        ("shipment_id",),
+    }
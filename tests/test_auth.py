@@ -0,0 +1,226 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+
+from faire.server import auth
+from faire.server.auth import (
+    JWKS_RETRY_SECONDS,
+    Authenticator,
+    AuthError,
+    AuthUnavailable,
+    SigningKeyCache,
+    TokenCache,
+    authenticate_request,
+    require_admin,
+    synced_brand_scope,
+)
+
+SECRET = "test-secret-long-enough-for-hmac-sha256"
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PUBLIC_JWK = jwt.PyJWK(
+    dict(
+        jwt.algorithms.RSAAlgorithm.to_jwk(PRIVATE_KEY.public_key(), as_dict=True),
+        kid="key-1",
+        alg="RS256",
+    )
+)
+
+
+def hs_token(**claims) -> str:
+    claims.setdefault("exp", int(time.time()) + 3600)
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def rs_token(kid: str = "key-1", **claims) -> str:
+    claims.setdefault("exp", int(time.time()) + 3600)
+    return jwt.encode(claims, PRIVATE_KEY, algorithm="RS256", headers={"kid": kid})
+
+
+class FakeJWKS(SigningKeyCache):
+    """Signing key cache whose fetches are counted and fail while down is set"""
+
+    def __init__(self, ttl_seconds: float = 3600):
+        super().__init__("http://jwks.test/keys", ttl_seconds)
+        self.down = False
+        self.fetches = 0
+
+    async def _refresh(self):
+        self.fetches += 1
+        # Yield like a real fetch would, so concurrent callers queue on the lock
+        await asyncio.sleep(0)
+        if self.down:
+            raise AuthUnavailable("Could not fetch signing keys: timed out")
+        self.keys = {PUBLIC_JWK.key_id: PUBLIC_JWK}
+        self.fetched_at = time.monotonic()
+
+
+@pytest.fixture(autouse=True)
+def auth_config(monkeypatch):
+    monkeypatch.setattr(auth.config, "auth_enabled", True)
+    monkeypatch.setattr(auth.config, "jwt_secret", SECRET)
+    monkeypatch.setattr(auth.config, "jwt_algorithms", "HS256,RS256")
+    monkeypatch.setattr(auth.config, "jwt_audience", "")
+    monkeypatch.setattr(auth.config, "jwt_issuer", "")
+
+
+def test_token_cache_expires_with_the_token():
+    cache = TokenCache(max_size=10, max_ttl_seconds=300)
+    cache.put(b"expired", {"exp": time.time() - 1})
+    assert cache.get(b"expired") is None
+    assert b"expired" not in cache.entries
+    cache.put(b"valid", {"exp": time.time() + 60})
+    assert cache.get(b"valid") is not None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_token_cache_caps_ttl_and_size(monkeypatch):
+    cache = TokenCache(max_size=2, max_ttl_seconds=10)
+    now = time.time()
+    cache.put(b"a", {"exp": now + 3600})
+    monkeypatch.setattr(auth.time, "time", lambda: now + 11)
+    assert cache.get(b"a") is None
+    cache.put(b"b", {})
+    cache.put(b"c", {})
+    cache.put(b"d", {})
+    assert list(cache.entries) == [b"c", b"d"]
+
+
+def test_verify_caches_claims():
+    authenticator = Authenticator(TokenCache(10, 300), SigningKeyCache(None, 0))
+    token = hs_token(brand="yate")
+    assert asyncio.run(authenticator.verify(token))["brand"] == "yate"
+    assert asyncio.run(authenticator.verify(token))["brand"] == "yate"
+    assert authenticator.token_cache.hits == 1
+
+
+def test_verify_rejects_expired_and_forged_tokens():
+    authenticator = Authenticator(None, SigningKeyCache(None, 0))
+    expired = hs_token(brand="yate", exp=int(time.time()) - 5)
+    with pytest.raises(AuthError):
+        asyncio.run(authenticator.verify(expired))
+    forged = jwt.encode({"brand": "yate"}, "other-secret", algorithm="HS256")
+    with pytest.raises(AuthError):
+        asyncio.run(authenticator.verify(forged))
+
+
+def test_jwks_outage_serves_cached_keys_after_one_attempt():
+    keys = FakeJWKS(ttl_seconds=60)
+    asyncio.run(keys.get("key-1"))
+    keys.down = True
+    keys.fetched_at -= 61
+
+    async def concurrent_gets():
+        return await asyncio.gather(*(keys.get("key-1") for _ in range(5)))
+
+    assert len(asyncio.run(concurrent_gets())) == 5
+    # One failed attempt answers every waiter, the next calls do not retry yet
+    assert keys.fetches == 2
+    asyncio.run(keys.get("key-1"))
+    assert keys.fetches == 2
+
+
+def test_jwks_outage_with_unknown_kid_is_unavailable():
+    keys = FakeJWKS()
+    keys.down = True
+    with pytest.raises(AuthUnavailable):
+        asyncio.run(keys.get("key-1"))
+    with pytest.raises(AuthUnavailable):
+        asyncio.run(keys.get("key-1"))
+    assert keys.fetches == 1
+    # Retried once the backoff has passed, and a recovered JWKS clears the error
+    keys.attempted_at -= JWKS_RETRY_SECONDS
+    keys.down = False
+    assert asyncio.run(keys.get("key-1")) is PUBLIC_JWK.key
+    assert keys.error is None and keys.fetches == 2
+
+
+def test_unknown_kid_is_invalid_when_jwks_is_up():
+    keys = FakeJWKS()
+    with pytest.raises(AuthError):
+        asyncio.run(keys.get("key-2"))
+
+
+def make_client(jwks: SigningKeyCache) -> TestClient:
+    verifier = Authenticator(None, jwks)
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def authenticate(request: Request, call_next):
+        # Same shape as the app's middleware
+        if not auth.config.auth_enabled:
+            return await call_next(request)
+        error = await authenticate_request(request, verifier)
+        if error is not None:
+            return error
+        return await call_next(request)
+
+    @app.get("/admin", dependencies=[Depends(require_admin)])
+    async def admin():
+        return {"ok": True}
+
+    @app.get("/analytics")
+    async def analytics(brand=Depends(synced_brand_scope("yate"))):
+        return {"brand": brand}
+
+    return TestClient(app)
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_missing_and_invalid_tokens_are_401():
+    client = make_client(FakeJWKS())
+    response = client.get("/analytics")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    assert client.get("/analytics", headers=bearer("not-a-jwt")).status_code == 401
+    expired = hs_token(brand="yate", exp=int(time.time()) - 5)
+    assert client.get("/analytics", headers=bearer(expired)).status_code == 401
+
+
+def test_token_without_brand_is_403():
+    client = make_client(FakeJWKS())
+    assert client.get("/analytics", headers=bearer(hs_token())).status_code == 403
+
+
+def test_admin_routes_need_the_admin_claim():
+    client = make_client(FakeJWKS())
+    member = hs_token(brand="yate")
+    assert client.get("/admin", headers=bearer(member)).status_code == 403
+    admin = hs_token(brand="yate", admin=True)
+    assert client.get("/admin", headers=bearer(admin)).status_code == 200
+    # Only a literal true counts
+    truthy = hs_token(brand="yate", admin="yes")
+    assert client.get("/admin", headers=bearer(truthy)).status_code == 403
+
+
+def test_unscoped_data_is_limited_to_the_synced_brand():
+    client = make_client(FakeJWKS())
+    response = client.get("/analytics", headers=bearer(rs_token(brand="yate")))
+    assert response.status_code == 200 and response.json() == {"brand": "yate"}
+    other = hs_token(brand="other", admin=True)
+    assert client.get("/analytics", headers=bearer(other)).status_code == 403
+
+
+def test_jwks_outage_is_503():
+    jwks = FakeJWKS()
+    jwks.down = True
+    client = make_client(jwks)
+    response = client.get("/analytics", headers=bearer(rs_token(brand="yate")))
+    assert response.status_code == 503
+    # HS tokens do not need the JWKS
+    response = client.get("/analytics", headers=bearer(hs_token(brand="yate")))
+    assert response.status_code == 200
+
+
+def test_auth_disabled_lets_every_caller_in(monkeypatch):
+    monkeypatch.setattr(auth.config, "auth_enabled", False)
+    client = make_client(FakeJWKS())
+    assert client.get("/admin").status_code == 200
+    assert client.get("/analytics").json() == {"brand": None}
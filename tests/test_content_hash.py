@@ -0,0 +1,80 @@
+import asyncio
+import json
+from pathlib import Path
+
+from faire.server import content_hash as content_hash_module
+from faire.server.content_hash import INGEST_VERSION, OrderHashIndex, content_hash
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"]
+SAMPLE = {"id": "bo_1", "state": "NEW", "items": [{"id": "oi_1", "quantity": 4}]}
+
+
+def test_hash_is_pinned():
+    # A different value means every stored order is rewritten on the next sync. That
+    # is only wanted together with an INGEST_VERSION bump; update both deliberately.
+    assert INGEST_VERSION == 6
+    assert content_hash(SAMPLE) == -8253385732055368381
+
+
+def test_hash_ignores_key_order_and_formatting():
+    for raw_order in ORDERS:
+        reordered = json.loads(json.dumps(raw_order, sort_keys=True, indent=4))
+        reordered = dict(reversed(list(reordered.items())))
+        assert content_hash(reordered) == content_hash(raw_order)
+
+
+def test_hash_changes_with_the_data():
+    hashes = {content_hash(raw_order) for raw_order in ORDERS}
+    assert len(hashes) == len(ORDERS)
+    changed = dict(ORDERS[0], state="CANCELED")
+    assert content_hash(changed) != content_hash(ORDERS[0])
+    item = dict(ORDERS[0]["items"][0], quantity=5)
+    assert content_hash(dict(ORDERS[0], items=[item])) != content_hash(ORDERS[0])
+
+
+def test_hash_depends_on_ingest_version(monkeypatch):
+    before = content_hash(SAMPLE)
+    monkeypatch.setattr(content_hash_module, "INGEST_VERSION", INGEST_VERSION + 1)
+    assert content_hash(SAMPLE) != before
+
+
+def test_hash_fits_bson_int64():
+    for raw_order in ORDERS:
+        assert -(2 ** 63) <= content_hash(raw_order) < 2 ** 63
+
+
+class FakeOrderCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        ids = (query.get("provider_order_id") or {}).get("$in")
+
+        async def cursor():
+            for document in self.documents:
+                if ids is None or document["provider_order_id"] in ids:
+                    yield document
+
+        return cursor()
+
+
+def test_refresh_rereads_stored_hashes(monkeypatch):
+    stored = [
+        {"provider_order_id": "bo_1", "content_hash": 1},
+        {"provider_order_id": "bo_2", "content_hash": 2},
+    ]
+    collection = FakeOrderCollection(stored)
+    engine = content_hash_module.engine
+    monkeypatch.setattr(engine, "get_collection", lambda model: collection)
+    index = OrderHashIndex()
+    asyncio.run(index.reload())
+    assert index.is_unchanged("bo_1", 1) and index.is_unchanged("bo_2", 2)
+    # Another worker or an import rewrote bo_1 and removed the hash of bo_2
+    stored[0]["content_hash"] = 10
+    stored[1]["content_hash"] = None
+    asyncio.run(index.refresh(["bo_1", "bo_2"]))
+    assert not index.is_unchanged("bo_1", 1) and index.get("bo_1") == 10
+    assert index.get("bo_2") is None
+    index.record_documents([{"provider_order_id": "bo_3", "content_hash": 3}])
+    assert index.is_unchanged("bo_3", 3)
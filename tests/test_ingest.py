@@ -0,0 +1,82 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from faire.server.faire_client import FaireClient
+from faire.server.ingest import (
+    fast_datetime,
+    ingest_order,
+    ingest_order_items,
+    ingest_order_shipments,
+    validate_order_document,
+)
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"]
+# Sales index bookkeeping, added to item documents by product_sales.item_write
+SALES_FIELDS = ("sales_version", "sales_applied", "sales_pending")
+
+
+def model_documents(models) -> list:
+    documents = []
+    for model in models:
+        document = model.doc()
+        # Mongo assigns the _id of mapped documents on insert
+        document.pop("_id")
+        for field in SALES_FIELDS:
+            document.pop(field, None)
+        documents.append(document)
+    return documents
+
+
+@pytest.fixture(scope="module")
+def faire_client():
+    return FaireClient("yate")
+
+
+@pytest.mark.parametrize("raw_order", ORDERS, ids=[order["id"] for order in ORDERS])
+def test_order_mapper_matches_the_model_path(faire_client, raw_order):
+    [expected] = model_documents([faire_client.parse_order(raw_order)])
+    assert ingest_order(raw_order, brand="yate", sample_rate=0) == expected
+
+
+@pytest.mark.parametrize("raw_order", ORDERS, ids=[order["id"] for order in ORDERS])
+def test_item_and_shipment_mappers_match_the_model_path(faire_client, raw_order):
+    items = faire_client.parse_order_items(raw_order["items"])
+    assert ingest_order_items(raw_order) == model_documents(items)
+    shipments = faire_client.parse_order_shipments(raw_order["shipments"])
+    assert ingest_order_shipments(raw_order) == model_documents(shipments)
+
+
+def test_item_discounts_match_the_model_path(faire_client):
+    discount = {
+        "id": "d_1",
+        "code": "SPRING",
+        "discount_type": "PERCENTAGE",
+        "includes_free_shipping": False,
+        "discount_amount": {"amount_minor": 500, "currency": "USD"},
+        "discount_percentage": 10,
+    }
+    raw_order = dict(ORDERS[0])
+    raw_order["items"] = [dict(ORDERS[0]["items"][0], discounts=[discount])]
+    items = faire_client.parse_order_items(raw_order["items"])
+    assert ingest_order_items(raw_order) == model_documents(items)
+
+
+def test_mapped_orders_validate():
+    for raw_order in ORDERS:
+        document = ingest_order(raw_order, brand="yate", validate=True)
+        assert "_id" not in document
+        assert validate_order_document(document).provider_order_id == raw_order["id"]
+
+
+def test_fast_datetime():
+    assert fast_datetime("2023-02-14T01:05:22.000Z") == datetime(
+        2023, 2, 14, 1, 5, 22, tzinfo=timezone.utc
+    )
+    assert fast_datetime("2023-02-14T01:05:22+01:00") == datetime(
+        2023, 2, 14, 0, 5, 22, tzinfo=timezone.utc
+    )
+    assert fast_datetime(None) is None
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from faire.server.notifications import (
+    BACKORDERED,
+    CANCELED,
+    NEW_ORDER,
+    OrderEvent,
+    SlackNotifier,
+    digest_text,
+    order_events,
+)
+
+
+def raw_order(order_id: str, state: str, created_at: datetime = None) -> dict:
+    created_at = created_at or datetime.now(timezone.utc)
+    return {
+        "id": order_id,
+        "display_id": order_id.upper(),
+        "retailer_id": "r_1",
+        "state": state,
+        "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+    }
+
+
+def test_order_events_transitions():
+    orders = [
+        raw_order("bo_new", "NEW"),
+        raw_order("bo_backordered", "BACKORDERED"),
+        raw_order("bo_canceled", "CANCELED"),
+        raw_order("bo_unchanged", "CANCELED"),
+        raw_order("bo_shipped", "IN_TRANSIT"),
+    ]
+    previous = {
+        "bo_backordered": "PROCESSING",
+        "bo_canceled": "NEW",
+        "bo_unchanged": "CANCELED",
+        "bo_shipped": "PROCESSING",
+    }
+    events = order_events(orders, previous)
+    assert [(event.kind, event.order_id) for event in events] == [
+        (NEW_ORDER, "bo_new"),
+        (BACKORDERED, "bo_backordered"),
+        (CANCELED, "bo_canceled"),
+    ]
+    assert events[0].display_id == "BO_NEW" and events[0].retailer_id == "r_1"
+
+
+def test_backfilled_orders_are_not_new():
+    old = raw_order("bo_old", "DELIVERED", datetime(2023, 2, 14, tzinfo=timezone.utc))
+    fresh = raw_order("bo_fresh", "NEW")
+    events = order_events([old, fresh], {}, timedelta(hours=24))
+    assert [event.order_id for event in events] == ["bo_fresh"]
+    assert len(order_events([old], {})) == 1
+
+
+def test_backfilled_cancellations_are_not_reported():
+    created_at = datetime(2021, 6, 1, tzinfo=timezone.utc)
+    canceled = raw_order("bo_canceled", "CANCELED", created_at)
+    backordered = raw_order("bo_backordered", "BACKORDERED", created_at)
+    max_age = timedelta(hours=24)
+    assert order_events([canceled, backordered], {}, max_age) == []
+    # An old order the store already knew is a real transition
+    events = order_events([canceled], {"bo_canceled": "PROCESSING"}, max_age)
+    assert [(event.kind, event.order_id) for event in events] == [
+        (CANCELED, "bo_canceled")
+    ]
+    # So is a recent order that shows up already canceled
+    fresh = raw_order("bo_fresh", "CANCELED")
+    assert [event.kind for event in order_events([fresh], {}, max_age)] == [CANCELED]
+
+
+def test_digest_text_lists_and_summarizes():
+    events = [OrderEvent(NEW_ORDER, f"bo_{n}", f"D{n}", None) for n in range(3)]
+    events.append(OrderEvent(CANCELED, "bo_9", None, "r_9"))
+    text = digest_text(events, {NEW_ORDER: 2}, max_lines=2)
+    assert text == (
+        "*5 new orders*\n• D0\n• D1\n… and 3 more"
+        "\n\n"
+        "*1 canceled orders*\n• bo_9 (retailer r_9)"
+    )
+
+
+def test_digest_text_only_dropped_events():
+    assert digest_text([], {BACKORDERED: 4}, max_lines=5) == (
+        "*4 backordered orders*\n… and 4 more"
+    )
+
+
+def run_notifier(responses, events, buffer_size=100, max_retries=2):
+    """
+    Send one digest through a stand-in Slack answering with responses in turn
+    returns: notifier, requests received
+    """
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return responses[min(len(requests), len(responses)) - 1]
+
+    async def run():
+        notifier = SlackNotifier(
+            api_key="test",
+            api_url="http://slack.test/api/",
+            channels={NEW_ORDER: "#orders", BACKORDERED: "#ops", CANCELED: None},
+            digest_seconds=0,
+            buffer_size=buffer_size,
+            max_lines=10,
+            max_retries=max_retries,
+            transport=httpx.MockTransport(handler),
+        )
+        notifier.start()
+        notifier.notify(events)
+        # Let the worker send the digest, then check it survived whatever Slack said
+        for _ in range(50):
+            await asyncio.sleep(0)
+            if notifier.sent + notifier.failed:
+                break
+        await asyncio.sleep(0)
+        assert not notifier.task.done()
+        await notifier.stop()
+        return notifier
+
+    return asyncio.run(run()), requests
+
+
+def test_digest_sent_once_per_channel():
+    events = [
+        OrderEvent(NEW_ORDER, "bo_1", "D1", None),
+        OrderEvent(NEW_ORDER, "bo_2", "D2", None),
+        OrderEvent(CANCELED, "bo_3", "D3", None),
+    ]
+    notifier, requests = run_notifier([httpx.Response(200, json={"ok": True})], events)
+    assert len(requests) == 1
+    assert requests[0].url == "http://slack.test/api/chat.postMessage"
+    assert requests[0].headers["Authorization"] == "Bearer test"
+    assert notifier.dict()["sent"] == 1 and notifier.queued == 2
+
+
+def test_rate_limit_is_retried():
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(200, json={"ok": True}),
+    ]
+    events = [OrderEvent(NEW_ORDER, "bo_1", "D1", None)]
+    notifier, requests = run_notifier(responses, events)
+    assert len(requests) == 2
+    assert (notifier.sent, notifier.retried, notifier.failed) == (1, 1, 0)
+
+
+def test_invalid_response_does_not_stop_the_worker():
+    responses = [httpx.Response(200, text="<html>proxy error</html>")]
+    events = [OrderEvent(NEW_ORDER, "bo_1", "D1", None)]
+    notifier, requests = run_notifier(responses, events)
+    assert len(requests) == 1
+    assert (notifier.sent, notifier.failed) == (0, 1)
+
+
+def test_overflow_is_summarized():
+    events = [OrderEvent(BACKORDERED, f"bo_{n}", f"D{n}", None) for n in range(5)]
+    _, requests = run_notifier(
+        [httpx.Response(200, json={"ok": True})], events, buffer_size=2
+    )
+    text = requests[0].read().decode("utf-8")
+    assert "*5 backordered orders*" in text and "3 more" in text
@@ -0,0 +1,158 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from pymongo import ReplaceOne
+
+from faire.server import order_import
+from faire.server.order_import import (
+    MAX_JOB_ERRORS,
+    ImportFormatError,
+    ImportJob,
+    _ingest_batch,
+    iter_raw_orders,
+    start_import,
+    stop_imports,
+)
+from faire.server.order_store import newer_order_upsert_op, split_stale
+
+UTC = timezone.utc
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS_PAGE = ORDERS_PATH.read_bytes()
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def parse(data: bytes, chunk_size: int = 64) -> list:
+    async def collect():
+        return [order async for order in iter_raw_orders(_chunks(data, chunk_size))]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096, len(ORDERS_PAGE)])
+def test_page_matches_json_load(chunk_size):
+    assert parse(ORDERS_PAGE, chunk_size) == json.loads(ORDERS_PAGE)["orders"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1024])
+def test_bare_list(chunk_size):
+    orders = [{"id": "bo_1", "total": 12}, {"id": "bo_2", "total": 3.5}]
+    assert parse(json.dumps(orders, indent=2).encode(), chunk_size) == orders
+
+
+def test_metadata_after_orders_and_empty_list():
+    data = b'{"orders": [], "page": 2, "limit": 50}'
+    assert parse(data, 3) == []
+    assert parse(b" [ ] ", 1) == []
+
+
+def test_number_split_across_chunks():
+    # "1234" must not be decoded as 12 when the chunk boundary falls inside it
+    assert parse(b'[{"id": "bo_1"}, 1234]', 18) == [{"id": "bo_1"}, 1234]
+
+
+def test_multibyte_character_split_across_chunks():
+    orders = [{"id": "bo_1", "product_name": "Yaté Sparkling Yerba Mate"}]
+    data = json.dumps(orders, ensure_ascii=False).encode("utf-8")
+    for chunk_size in range(1, 8):
+        assert parse(data, chunk_size) == orders
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'"orders"',
+        b'{"orders": [{"id": "bo_1"} {"id": "bo_2"}]}',
+        b'{"orders": [{"id": "bo_1"}',
+        b'{"orders" [{"id": "bo_1"}]}',
+    ],
+)
+def test_malformed_upload(data):
+    with pytest.raises(ImportFormatError):
+        parse(data, 4)
+
+
+def test_ingest_batch_validates_and_reports_failures():
+    orders = json.loads(ORDERS_PAGE)["orders"]
+    broken = {"id": "bo_broken", "created_at": "not a date"}
+    documents, errors = _ingest_batch(orders + [broken], "yate")
+    assert [document["provider_order_id"] for document in documents] == [
+        order["id"] for order in orders
+    ]
+    assert all(document["brand"] == "yate" for document in documents)
+    assert len(errors) == 1 and errors[0].startswith("order bo_broken:")
+
+
+def test_stale_orders_are_split_off():
+    stored = {"bo_1": datetime(2023, 5, 2, 6, 18, 14), "bo_2": datetime(2023, 5, 2)}
+    documents = [
+        {"provider_order_id": "bo_1", "updated_at": datetime(2023, 5, 1, tzinfo=UTC)},
+        {"provider_order_id": "bo_2", "updated_at": datetime(2023, 5, 2, tzinfo=UTC)},
+        {"provider_order_id": "bo_3", "updated_at": datetime(2020, 1, 1, tzinfo=UTC)},
+        {"provider_order_id": "bo_1", "updated_at": None},
+    ]
+    fresh, stale = split_stale(documents, stored)
+    assert [document["provider_order_id"] for document in fresh] == ["bo_2", "bo_3"]
+    assert stale == ["bo_1", "bo_1"]
+
+
+def test_newer_order_upsert_is_conditional_on_updated_at():
+    updated_at = datetime(2023, 5, 2, tzinfo=UTC)
+    document = {"_id": "old-id", "provider_order_id": "bo_1", "updated_at": updated_at}
+    operation = newer_order_upsert_op(document)
+    assert operation == ReplaceOne(
+        {
+            "provider_order_id": "bo_1",
+            "$or": [{"updated_at": {"$lte": updated_at}}, {"updated_at": None}],
+        },
+        {"provider_order_id": "bo_1", "updated_at": updated_at},
+        upsert=True,
+    )
+
+
+def test_stale_order_ids_are_capped():
+    job = ImportJob("orders.json")
+    job.add_stale([f"bo_{n}" for n in range(MAX_JOB_ERRORS + 5)])
+    assert job.orders_stale == MAX_JOB_ERRORS + 5
+    assert len(job.dict()["stale_order_ids"]) == MAX_JOB_ERRORS
+
+
+class StalledFaireClient:
+    """Writes hang until cancelled, like a deploy in the middle of a batch"""
+
+    brand = "yate"
+
+    async def save_newer_order_documents(self, raw_orders, documents):
+        await asyncio.Event().wait()
+
+
+def test_stop_imports_fails_the_job_and_removes_the_spool(monkeypatch, tmp_path):
+    saved = []
+
+    async def save(job):
+        saved.append(job.dict())
+
+    monkeypatch.setattr(order_import.import_jobs, "save", save)
+    spool = tmp_path / "orders.json"
+    spool.write_bytes(ORDERS_PAGE)
+
+    async def run():
+        job = ImportJob("orders.json")
+        start_import(str(spool), StalledFaireClient(), job)
+        while not job.orders_seen:
+            await asyncio.sleep(0.01)
+        await stop_imports()
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == "failed" and job.finished_at is not None
+    assert saved[-1]["status"] == "failed"
+    assert not spool.exists()
+    assert not order_import._import_tasks
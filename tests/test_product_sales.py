@@ -0,0 +1,128 @@
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from faire.server.product_sales import item_contribution, item_write, sales_deltas
+
+DAY = datetime(2023, 2, 14)
+
+
+def make_item(**changes) -> dict:
+    item = {
+        "order_item_id": "oi_1",
+        "product_id": "p_1",
+        "variant_id": "po_1",
+        "created_at": datetime(2023, 2, 14, 0, 30, 36),
+        "state": "DELIVERED",
+        "quantity": 4,
+        "price": {"amount_minor": 4680, "currency": "USD"},
+        "includes_tester": True,
+    }
+    item.update(changes)
+    return item
+
+
+def test_item_contribution():
+    assert item_contribution(make_item()) == {
+        "product_id": "p_1",
+        "variant_id": "po_1",
+        "day": DAY,
+        "units": 4,
+        "gross_minor": 18720,
+        "tester_count": 1,
+        "item_count": 1,
+    }
+    assert item_contribution(make_item(state="CANCELED")) is None
+    assert item_contribution(None) is None
+
+
+def test_new_item_adds_its_contribution():
+    contribution = item_contribution(make_item())
+    assert sales_deltas(None, contribution) == {
+        ("p_1", "po_1", DAY): {
+            "units": 4,
+            "gross_minor": 18720,
+            "tester_count": 1,
+            "item_count": 1,
+        }
+    }
+
+
+def test_unchanged_item_has_no_deltas():
+    contribution = item_contribution(make_item())
+    assert sales_deltas(contribution, dict(contribution)) == {}
+    assert sales_deltas(None, None) == {}
+
+
+def test_canceled_item_is_subtracted():
+    applied = item_contribution(make_item())
+    assert sales_deltas(applied, None) == {
+        ("p_1", "po_1", DAY): {
+            "units": -4,
+            "gross_minor": -18720,
+            "tester_count": -1,
+            "item_count": -1,
+        }
+    }
+
+
+def test_quantity_change_only_moves_changed_counters():
+    applied = item_contribution(make_item())
+    contribution = item_contribution(make_item(quantity=6))
+    assert sales_deltas(applied, contribution) == {
+        ("p_1", "po_1", DAY): {
+            "units": 2,
+            "gross_minor": 9360,
+            "tester_count": 0,
+            "item_count": 0,
+        }
+    }
+
+
+def test_item_moved_to_another_day():
+    applied = item_contribution(make_item())
+    contribution = item_contribution(make_item(created_at=datetime(2023, 2, 15, 9)))
+    deltas = sales_deltas(applied, contribution)
+    assert deltas[("p_1", "po_1", DAY)]["units"] == -4
+    assert deltas[("p_1", "po_1", datetime(2023, 2, 15))]["units"] == 4
+
+
+def test_item_write_new_item():
+    operation, document = item_write(make_item(), None)
+    assert operation == ReplaceOne(
+        {"order_item_id": "oi_1", "sales_version": {"$exists": False}},
+        document,
+        upsert=True,
+    )
+    assert document["sales_version"] == 1
+    assert document["sales_applied"] is None
+    assert document["sales_pending"] == {
+        "op": "oi_1:1",
+        "applied": item_contribution(make_item()),
+    }
+
+
+def test_item_write_unchanged_item_has_nothing_pending():
+    _, stored = item_write(make_item(), None)
+    stored = dict(stored, sales_applied=stored["sales_pending"]["applied"])
+    stored["sales_pending"] = None
+    operation, document = item_write(make_item(), stored)
+    assert operation == ReplaceOne(
+        {"order_item_id": "oi_1", "sales_version": 1}, document, upsert=True
+    )
+    assert document["sales_version"] == 2
+    assert document["sales_applied"] == item_contribution(make_item())
+    assert document["sales_pending"] is None
+
+
+def test_item_write_before_versioning():
+    # Stored by a release without sales_version, its fields were already applied
+    stored = make_item()
+    operation, document = item_write(make_item(state="CANCELED"), stored)
+    assert operation == ReplaceOne(
+        {"order_item_id": "oi_1", "sales_version": {"$exists": False}},
+        document,
+        upsert=True,
+    )
+    assert document["sales_applied"] == item_contribution(stored)
+    assert document["sales_pending"] == {"op": "oi_1:1", "applied": None}
@@ -0,0 +1,65 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from faire.server.ingest import (
+    ingest_order,
+    ingest_order_items,
+    ingest_order_shipments,
+    map_order,
+    map_order_timed,
+)
+from faire.server.profiling import SamplingProfiler, span, timings
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"]
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    monkeypatch.setattr(timings, "enabled", True)
+    timings.reset()
+    yield timings
+    timings.reset()
+
+
+def test_spans_are_free_when_disabled(monkeypatch):
+    monkeypatch.setattr(timings, "enabled", False)
+    timings.reset()
+    with span("sync.fetch"):
+        pass
+    assert timings.dict() == {}
+
+
+def test_fast_ingest_records_the_sub_parser_breakdown(spans):
+    for raw_order in ORDERS:
+        ingest_order(raw_order, brand="yate", sample_rate=0)
+        ingest_order_items(raw_order)
+        ingest_order_shipments(raw_order)
+    recorded = spans.dict()
+    for name in (
+        "ingest.address",
+        "ingest.payout",
+        "ingest.customer",
+        "ingest.promotions",
+        "ingest.dates",
+        "ingest.items",
+        "ingest.shipments",
+        "ingest.search_tokens",
+    ):
+        assert recorded[name]["count"] >= len(ORDERS), name
+
+
+def test_timed_mapper_maps_like_the_plain_one():
+    for raw_order in ORDERS:
+        assert map_order_timed(raw_order) == map_order(raw_order)
+
+
+def test_profile_output_is_per_process(tmp_path):
+    profiler = SamplingProfiler(interval=0.001, output_dir=str(tmp_path))
+    path = profiler.start(0.01)
+    profiler.thread.join()
+    assert os.path.basename(path).endswith(f"-{os.getpid()}.folded")
+    assert Path(path).exists()
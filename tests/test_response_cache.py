@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from faire.server.response_cache import ResponseCache, etag_matches, make_etag
+
+UPDATED_AT = datetime(2023, 5, 2, 6, 18, 14)
+PARAMS = {"brand": "yate", "limit": 2, "skip": 0}
+
+
+def test_etag_is_stable_and_quoted():
+    version = [["a", "hash-a", UPDATED_AT], ["b", "hash-b", UPDATED_AT]]
+    etag = make_etag("orders", PARAMS, version)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("orders", dict(reversed(list(PARAMS.items()))), version)
+
+
+def test_etag_changes_with_membership_order_and_content():
+    page = [["a", "hash-a", UPDATED_AT], ["b", "hash-b", UPDATED_AT]]
+    etag = make_etag("orders", PARAMS, page)
+    # An order written between polls shifts the page, hashes alone would not show it
+    shifted = [["c", "hash-b", UPDATED_AT], ["a", "hash-a", UPDATED_AT]]
+    assert make_etag("orders", PARAMS, shifted) != etag
+    assert make_etag("orders", PARAMS, list(reversed(page))) != etag
+    changed = [["a", "hash-a2", UPDATED_AT], ["b", "hash-b", UPDATED_AT]]
+    assert make_etag("orders", PARAMS, changed) != etag
+    assert make_etag("orders", dict(PARAMS, skip=2), page) != etag
+    assert make_etag("order", PARAMS, page) != etag
+
+
+def test_etag_matches():
+    etag = make_etag("orders", PARAMS, [])
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("W/" + etag, etag)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2, max_bytes=100)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_cache_bounded_by_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=10)
+    cache.put("too-large", b"x" * 11)
+    assert cache.get("too-large") is None
+    cache.put("a", b"x" * 6)
+    cache.put("b", b"x" * 6)
+    assert cache.get("a") is None
+    assert cache.size == 6
+    cache.put("b", b"x" * 2)
+    assert cache.size == 2
+    cache.invalidate()
+    assert cache.size == 0 and cache.get("b") is None
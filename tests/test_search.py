@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from faire.server.search import (
+    normalize,
+    order_search_tokens,
+    phone_digits,
+    query_terms,
+)
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"]
+
+
+def test_normalize_strips_accents_and_punctuation():
+    assert normalize("Yaté Sparkling Yerba Mate (24 pack)") == [
+        "yate", "sparkling", "yerba", "mate", "24", "pack"
+    ]
+    assert normalize(None) == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "(541) 326-7572",
+        "541-326-7572",
+        "541.326.7572",
+        "+1 541 326 7572",
+        "+1 (541) 326-7572",
+        "1-541-326-7572",
+        "541 326 7572",
+    ],
+)
+def test_formatted_phone_collapses_to_digits(query):
+    assert query_terms(query) == ["5413267572"]
+
+
+def test_country_code_is_dropped_when_indexing():
+    address = dict(ORDERS[0]["address"], phone_number="+15413267572")
+    order = dict(ORDERS[0], address=address)
+    assert "5413267572" in order_search_tokens(order)
+    assert "15413267572" not in order_search_tokens(order)
+
+
+def test_other_numbers_keep_every_digit():
+    assert phone_digits("+44 20 7946 0958") == "442079460958"
+    assert phone_digits("25413267572") == "25413267572"
+    assert query_terms("+44 20 7946 0958") == ["442079460958"]
+
+
+def test_stored_phone_matches_formatted_query():
+    tokens = order_search_tokens(ORDERS[0])
+    assert ORDERS[0]["address"]["phone_number"] in tokens
+    assert set(query_terms("(541) 326-7572")) <= set(tokens)
+
+
+def test_short_numbers_stay_separate_terms():
+    assert query_terms("yerba 12 24") == ["yerba", "12", "24"]
+
+
+def test_query_terms_are_deduplicated_and_capped():
+    assert query_terms("Mate mate MATÉ") == ["mate"]
+    assert query_terms("a b") == []
+    assert len(query_terms("one two three four five six seven")) == 5
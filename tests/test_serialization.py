@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from bson import Decimal128, ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from faire.server.faire_client import FaireClient
+from faire.server.models.order import Order
+from faire.server.serialization import (
+    ORDER_FIELDS,
+    DocumentSerializer,
+    dumps,
+    order_serializer,
+)
+
+ORDERS_PATH = Path(__file__).resolve().parent.parent / "server" / "orders.json"
+ORDERS = json.loads(ORDERS_PATH.read_text("utf-8"))["orders"]
+
+
+def stored_document(raw_order: dict) -> dict:
+    """An order document as motor reads it back, with naive UTC datetimes"""
+    document = FaireClient("yate").parse_order(raw_order).doc()
+    return {
+        key: value.replace(tzinfo=None) if isinstance(value, datetime) else value
+        for key, value in document.items()
+    }
+
+
+@pytest.mark.parametrize("raw_order", ORDERS, ids=[order["id"] for order in ORDERS])
+def test_order_json_matches_the_model_path(raw_order):
+    document = stored_document(raw_order)
+    expected = jsonable_encoder(Order.parse_doc(document))
+    for internal in ("content_hash", "search_tokens", "brand"):
+        expected.pop(internal)
+    assert json.loads(order_serializer.dumps(document)) == expected
+
+
+def test_id_datetime_and_projection():
+    _id = ObjectId()
+    serializer = DocumentSerializer(("display_id", "created_at", "missing"))
+    assert serializer.projection == {"display_id": 1, "created_at": 1, "missing": 1}
+    document = {
+        "_id": _id,
+        "display_id": "SWE87MPJJ9",
+        "created_at": datetime(2023, 2, 14, 1, 5, 22),
+        "content_hash": 42,
+    }
+    assert json.loads(serializer.dumps(document)) == {
+        "id": str(_id),
+        "display_id": "SWE87MPJJ9",
+        "created_at": "2023-02-14T01:05:22",
+        "missing": None,
+    }
+
+
+def test_internal_fields_are_not_public():
+    assert "content_hash" not in ORDER_FIELDS
+    assert "search_tokens" not in ORDER_FIELDS
+
+
+def test_dumps_many_and_none():
+    documents = [{"_id": ObjectId(), "display_id": str(n)} for n in range(3)]
+    serializer = DocumentSerializer(("display_id",))
+    items = json.loads(serializer.dumps_many(documents))
+    assert [item["display_id"] for item in items] == ["0", "1", "2"]
+    assert serializer.dumps_many([]) == b"[]"
+    assert serializer.dumps(None) == b"null"
+
+
+def test_bson_types():
+    _id = ObjectId()
+    assert json.loads(dumps({"a": _id, "b": Decimal128(Decimal("1.50"))})) == {
+        "a": str(_id),
+        "b": "1.50",
+    }
+    with pytest.raises(TypeError):
+        dumps({"a": object()})
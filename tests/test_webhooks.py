@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+from faire.server import webhooks
+from faire.server.webhooks import (
+    InvalidWebhook,
+    OrderFetchQueue,
+    SeenEvents,
+    event_order_id,
+    verify_signature,
+)
+
+SECRET = "webhook-secret"
+BODY = b'{"event_id": "ev_1", "data": {"order_id": "bo_1"}}'
+SIGNATURE = hmac.new(SECRET.encode(), BODY, hashlib.sha256).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "signature", [SIGNATURE, f"sha256={SIGNATURE}", SIGNATURE.upper(), f" {SIGNATURE} "]
+)
+def test_valid_signature(signature):
+    assert verify_signature(BODY, signature, SECRET)
+
+
+@pytest.mark.parametrize(
+    "signature",
+    [None, "", "sha256=", SIGNATURE[:-1], "0" * len(SIGNATURE), "sha256=\xe9", "é" * 64],
+)
+def test_invalid_signature(signature):
+    assert not verify_signature(BODY, signature, SECRET)
+
+
+def test_signature_of_another_body_or_secret():
+    assert not verify_signature(BODY + b" ", SIGNATURE, SECRET)
+    assert not verify_signature(BODY, SIGNATURE, "other-secret")
+    assert not verify_signature(BODY, SIGNATURE, "")
+
+
+def test_event_order_id():
+    assert event_order_id({"data": {"order_id": "bo_1"}}) == "bo_1"
+    assert event_order_id({"data": {"order": {"id": "bo_2"}}}) == "bo_2"
+    assert event_order_id({"order_id": "bo_3"}) == "bo_3"
+    with pytest.raises(InvalidWebhook):
+        event_order_id({"data": {}})
+
+
+class FakeEventCollection:
+    """The two calls SeenEvents makes, against a dict"""
+
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query, projection):
+        return self.documents.get(query["_id"])
+
+    async def bulk_write(self, operations, ordered):
+        for operation in operations:
+            self.documents.setdefault(operation._filter["_id"], operation._doc)
+
+
+class FakeFaireClient:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.fetches = []
+
+    async def get_order(self, order_id):
+        self.fetches.append(order_id)
+        if order_id in self.failing:
+            raise Exception("Could not connect to API Endpoint")
+
+
+@pytest.fixture
+def seen_events(monkeypatch):
+    events = SeenEvents(ttl_seconds=3600)
+    collection = FakeEventCollection()
+    monkeypatch.setattr(events, "collection", lambda: collection)
+    monkeypatch.setattr(webhooks, "seen_events", events)
+    return events
+
+
+def test_events_for_one_order_are_coalesced(seen_events):
+    faire_client = FakeFaireClient()
+    queue = OrderFetchQueue(faire_client, coalesce_seconds=0, max_concurrency=2)
+    for event_id, order_id in (("ev_1", "bo_1"), ("ev_2", "bo_1"), ("ev_3", "bo_2")):
+        queue.enqueue(order_id, event_id)
+    queue.enqueue("bo_1")
+    assert queue.dict()["pending"] == 2 and queue.coalesced == 2
+    asyncio.run(queue.drain())
+    assert sorted(faire_client.fetches) == ["bo_1", "bo_2"]
+    assert queue.dict() == {"pending": 0, "fetched": 2, "coalesced": 2, "failed": 0}
+    for event_id in ("ev_1", "ev_2", "ev_3"):
+        assert asyncio.run(seen_events.seen(event_id))
+
+
+def test_events_are_seen_only_after_their_order_was_fetched(seen_events):
+    faire_client = FakeFaireClient(failing={"bo_1"})
+    queue = OrderFetchQueue(faire_client, coalesce_seconds=0, max_concurrency=2)
+    queue.enqueue("bo_1", "ev_1")
+    queue.enqueue("bo_2", "ev_2")
+    asyncio.run(queue.drain())
+    assert queue.failed == 1
+    # A redelivery of ev_1 is processed again, ev_2 is dropped
+    assert not asyncio.run(seen_events.seen("ev_1"))
+    assert asyncio.run(seen_events.seen("ev_2"))
+
+
+def test_stop_drains_pending_orders(seen_events):
+    faire_client = FakeFaireClient()
+
+    async def run():
+        queue = OrderFetchQueue(faire_client, coalesce_seconds=60, max_concurrency=1)
+        queue.start()
+        queue.enqueue("bo_1", "ev_1")
+        await asyncio.sleep(0)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert faire_client.fetches == ["bo_1"]